@@ -1,18 +1,50 @@
 import os
+import re
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from .video_id import canonical_video_key, fallback_key
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-DATA_DIR = os.path.join(BASE_DIR, "data")
+DATA_DIR = os.path.abspath(os.getenv("QKNOTE_DATA_DIR") or os.path.join(BASE_DIR, "data"))
+AUDIO_DIR = os.path.abspath(os.getenv("QKNOTE_AUDIO_DIR") or os.path.join(DATA_DIR, "audio"))
 DB_PATH = os.path.join(DATA_DIR, "app.db")
+# Bump whenever init_db gains a table, column or index so existing databases migrate once.
+SCHEMA_VERSION = 13
+# Other processes (standalone workers) write without invalidating this process's cache,
+# so cached rows also expire after a short TTL.
+CONFIG_CACHE_SECONDS = float(os.getenv("QKNOTE_CONFIG_CACHE_SECONDS", "30"))
+SESSION_CACHE_SECONDS = float(os.getenv("QKNOTE_SESSION_CACHE_SECONDS", "2"))
+SESSION_CACHE_SIZE = 256
+# Transcript and note text can run to megabytes, so the cache holds every other column only.
+SESSION_TEXT_COLUMNS = ("transcript", "note")
+# Deleted-session markers kept for delta streams; older resume points get a fresh snapshot.
+TOMBSTONE_KEEP = 1000
+# A finished flight answers identical work for this long, then the work runs afresh.
+FLIGHT_DONE_SECONDS = float(os.getenv("QKNOTE_FLIGHT_DONE_SECONDS", "600"))
+SUMMARY_COLUMNS = ("id", "url", "title", "style", "remark", "status", "stage", "created_at", "updated_at")
+
+_cache_lock = threading.Lock()
+_cache_generation = 0
+_config_cache: tuple[float, dict] | None = None
+_session_cache: "OrderedDict[int, tuple[float, dict]]" = OrderedDict()
+_session_meta_columns: str | None = None
+_cache_stats = {"config_hits": 0, "config_misses": 0, "session_hits": 0, "session_misses": 0}
 
 
 def _utc_now() -> str:
     return datetime.utcnow().isoformat(timespec="seconds")
 
 
+def _utc_after(seconds: float) -> str:
+    return (datetime.utcnow() + timedelta(seconds=seconds)).isoformat(timespec="seconds")
+
+
 def _get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON")
     return conn
@@ -21,6 +53,9 @@ def _get_conn() -> sqlite3.Connection:
 def init_db() -> None:
     os.makedirs(DATA_DIR, exist_ok=True)
     with _get_conn() as conn:
+        if conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+            return
+        conn.execute("PRAGMA journal_mode = WAL")
         conn.executescript(
             """
             CREATE TABLE IF NOT EXISTS config (
@@ -43,10 +78,32 @@ def init_db() -> None:
                 error TEXT,
                 transcript TEXT,
                 note TEXT,
+                include_joke INTEGER NOT NULL DEFAULT 1,
+                video_key TEXT,
+                audio_offsets TEXT,
+                trimmed_seconds REAL,
+                trimmed_bytes INTEGER,
+                audio_file TEXT,
+                audio_used_at TEXT,
+                audio_evicted_at TEXT,
+                lease_owner TEXT,
+                lease_expires_at TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                profile INTEGER NOT NULL DEFAULT 0,
+                change_seq INTEGER NOT NULL DEFAULT 0,
+                transcript_gen INTEGER NOT NULL DEFAULT 0,
+                waiting_on TEXT,
                 created_at TEXT NOT NULL,
                 updated_at TEXT NOT NULL
             );
 
+            CREATE TABLE IF NOT EXISTS video_probes (
+                url TEXT PRIMARY KEY,
+                video_key TEXT NOT NULL,
+                title TEXT,
+                created_at TEXT NOT NULL
+            );
+
             CREATE TABLE IF NOT EXISTS session_steps (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 session_id INTEGER NOT NULL,
@@ -57,17 +114,227 @@ def init_db() -> None:
                 updated_at TEXT NOT NULL,
                 FOREIGN KEY(session_id) REFERENCES sessions(id) ON DELETE CASCADE
             );
+
+            CREATE TABLE IF NOT EXISTS session_notes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id INTEGER NOT NULL,
+                style TEXT,
+                remark TEXT,
+                include_joke INTEGER NOT NULL DEFAULT 1,
+                status TEXT NOT NULL,
+                note TEXT,
+                error TEXT,
+                lease_owner TEXT,
+                lease_expires_at TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                FOREIGN KEY(session_id) REFERENCES sessions(id) ON DELETE CASCADE
+            );
+
+            CREATE TABLE IF NOT EXISTS transcript_segments (
+                session_id INTEGER NOT NULL,
+                idx INTEGER NOT NULL,
+                start_ms INTEGER NOT NULL,
+                end_ms INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (session_id, idx),
+                FOREIGN KEY(session_id) REFERENCES sessions(id) ON DELETE CASCADE
+            ) WITHOUT ROWID;
+
+            CREATE TABLE IF NOT EXISTS change_log (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                seq INTEGER NOT NULL,
+                floor INTEGER NOT NULL DEFAULT 0
+            );
+
+            CREATE TABLE IF NOT EXISTS session_tombstones (
+                change_seq INTEGER PRIMARY KEY,
+                session_id INTEGER NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS flights (
+                key TEXT PRIMARY KEY,
+                session_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                FOREIGN KEY(session_id) REFERENCES sessions(id) ON DELETE CASCADE
+            );
+
+            CREATE TABLE IF NOT EXISTS api_keys (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                api_key TEXT NOT NULL UNIQUE,
+                label TEXT,
+                requests INTEGER NOT NULL DEFAULT 0,
+                failures INTEGER NOT NULL DEFAULT 0,
+                throttled INTEGER NOT NULL DEFAULT 0,
+                cooldown_until TEXT,
+                last_error TEXT,
+                last_used_at TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS uploads (
+                file_id TEXT PRIMARY KEY,
+                api_key TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                file_url TEXT,
+                expires_at REAL NOT NULL,
+                users INTEGER NOT NULL DEFAULT 0,
+                in_use_until REAL NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL
+            );
+            """
+        )
+        # The single configured key becomes the first member of the key pool.
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO api_keys (api_key, created_at, updated_at)
+            SELECT api_key, created_at, updated_at FROM config WHERE id = 1
             """
         )
         columns = [row["name"] for row in conn.execute("PRAGMA table_info(sessions)").fetchall()]
         if "title" not in columns:
             conn.execute("ALTER TABLE sessions ADD COLUMN title TEXT")
+        if "include_joke" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN include_joke INTEGER NOT NULL DEFAULT 1")
+        if "lease_owner" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN lease_owner TEXT")
+        if "lease_expires_at" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN lease_expires_at TEXT")
+        if "attempts" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        if "video_key" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN video_key TEXT")
+        if "audio_offsets" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN audio_offsets TEXT")
+        if "trimmed_seconds" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN trimmed_seconds REAL")
+        if "trimmed_bytes" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN trimmed_bytes INTEGER")
+        if "audio_file" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN audio_file TEXT")
+            conn.executemany("UPDATE sessions SET audio_file = ? WHERE id = ?", _existing_audio_files())
+        if "audio_used_at" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN audio_used_at TEXT")
+        if "audio_evicted_at" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN audio_evicted_at TEXT")
+        if "profile" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN profile INTEGER NOT NULL DEFAULT 0")
+        if "change_seq" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0")
+            conn.execute("UPDATE sessions SET change_seq = id")
+        if "transcript_gen" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN transcript_gen INTEGER NOT NULL DEFAULT 0")
+        if "waiting_on" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN waiting_on TEXT")
+        conn.execute("INSERT OR IGNORE INTO change_log (id, seq) SELECT 1, COALESCE(MAX(id), 0) FROM sessions")
+        _create_change_triggers(conn)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_queue ON sessions(status, lease_expires_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_video_key ON sessions(video_key, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_session_notes_session ON session_notes(session_id, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_segments_time ON transcript_segments(session_id, start_ms)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_change_seq ON sessions(change_seq)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_flights_session ON flights(session_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_session_notes_queue ON session_notes(status, lease_expires_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_uploads_digest ON uploads(api_key, digest, expires_at)")
+        pending_keys = conn.execute("SELECT id, url FROM sessions WHERE video_key IS NULL").fetchall()
+        conn.executemany(
+            "UPDATE sessions SET video_key = ? WHERE id = ?",
+            [(canonical_video_key(row["url"]) or fallback_key(row["url"]), row["id"]) for row in pending_keys],
+        )
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def _create_change_triggers(conn: sqlite3.Connection) -> None:
+    """Stamp sessions with a monotonic change_seq whenever a list-summary column changes.
+
+    Writers are serialized by SQLite, so sequence order is commit order. The triggers'
+    own UPDATE of change_seq does not re-fire them (recursive triggers are off).
+    """
+    watched = [column for column in SUMMARY_COLUMNS if column not in {"id", "created_at"}]
+    changed = " OR ".join(f"NEW.{column} IS NOT OLD.{column}" for column in watched)
+    bump = """
+        UPDATE change_log SET seq = seq + 1 WHERE id = 1;
+        UPDATE sessions SET change_seq = (SELECT seq FROM change_log WHERE id = 1) WHERE id = NEW.id;
+    """
+    conn.executescript(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_sessions_change_insert AFTER INSERT ON sessions
+        BEGIN {bump} END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_sessions_change_update AFTER UPDATE OF {", ".join(watched)} ON sessions
+        WHEN {changed}
+        BEGIN {bump} END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_sessions_change_delete AFTER DELETE ON sessions
+        BEGIN
+            UPDATE change_log SET seq = seq + 1 WHERE id = 1;
+            INSERT INTO session_tombstones (change_seq, session_id)
+            VALUES ((SELECT seq FROM change_log WHERE id = 1), OLD.id);
+        END;
+        """
+    )
+
+
+def cache_stats() -> dict:
+    with _cache_lock:
+        return {**_cache_stats, "sessions_cached": len(_session_cache)}
+
+
+def _invalidate_config() -> None:
+    global _cache_generation, _config_cache
+    with _cache_lock:
+        _cache_generation += 1
+        _config_cache = None
+
+
+def _invalidate_session(session_id: int | None = None) -> None:
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+        if session_id is None:
+            _session_cache.clear()
+        else:
+            _session_cache.pop(session_id, None)
+
+
+def _existing_audio_files() -> list[tuple[str, int]]:
+    if not os.path.isdir(AUDIO_DIR):
+        return []
+    latest: dict[int, os.DirEntry] = {}
+    for entry in os.scandir(AUDIO_DIR):
+        match = re.fullmatch(r"(\d+)\.\w+", entry.name)
+        if not match or not entry.is_file():
+            continue
+        session_id = int(match.group(1))
+        current = latest.get(session_id)
+        if current is None or entry.stat().st_mtime > current.stat().st_mtime:
+            latest[session_id] = entry
+    return [(entry.name, session_id) for session_id, entry in latest.items()]
 
 
 def get_config() -> dict | None:
+    global _config_cache
+    now = time.monotonic()
+    with _cache_lock:
+        if _config_cache and _config_cache[0] > now:
+            _cache_stats["config_hits"] += 1
+            return dict(_config_cache[1])
+        _cache_stats["config_misses"] += 1
+        generation = _cache_generation
     with _get_conn() as conn:
         row = conn.execute("SELECT * FROM config WHERE id = 1").fetchone()
-        return dict(row) if row else None
+    if not row:
+        # Not cached: a worker process must see a key saved through the API right away.
+        return None
+    config = dict(row)
+    with _cache_lock:
+        if generation == _cache_generation:
+            _config_cache = (now + CONFIG_CACHE_SECONDS, config)
+    return dict(config)
 
 
 def upsert_config(api_key: str, audio_model: str, text_model: str) -> None:
@@ -87,17 +354,159 @@ def upsert_config(api_key: str, audio_model: str, text_model: str) -> None:
             """,
             (api_key, audio_model, text_model, created_at, now),
         )
+    _invalidate_config()
 
 
-def create_session(url: str, style: str | None, remark: str | None) -> int:
+def list_api_keys() -> list[dict]:
+    with _get_conn() as conn:
+        rows = conn.execute("SELECT * FROM api_keys ORDER BY id").fetchall()
+    return [dict(row) for row in rows]
+
+
+def add_api_key(api_key: str, label: str | None = None) -> int:
+    """Add a key to the pool; re-adding a known key updates its label and puts it back in rotation."""
     now = _utc_now()
     with _get_conn() as conn:
-        cur = conn.execute(
+        conn.execute(
+            """
+            INSERT INTO api_keys (api_key, label, created_at, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(api_key) DO UPDATE SET
+                label = COALESCE(excluded.label, api_keys.label),
+                cooldown_until = NULL,
+                updated_at = excluded.updated_at
+            """,
+            (api_key, label, now, now),
+        )
+        return int(conn.execute("SELECT id FROM api_keys WHERE api_key = ?", (api_key,)).fetchone()[0])
+
+
+def delete_api_key(key_id: int) -> bool:
+    """Remove a key from the pool, moving the config row onto a remaining key (or dropping it)."""
+    with _get_conn() as conn:
+        row = conn.execute("SELECT api_key FROM api_keys WHERE id = ?", (key_id,)).fetchone()
+        if not row:
+            return False
+        conn.execute("DELETE FROM api_keys WHERE id = ?", (key_id,))
+        remaining = conn.execute("SELECT api_key FROM api_keys ORDER BY id DESC LIMIT 1").fetchone()
+        if remaining:
+            conn.execute(
+                "UPDATE config SET api_key = ?, updated_at = ? WHERE id = 1 AND api_key = ?",
+                (remaining[0], _utc_now(), row[0]),
+            )
+        else:
+            conn.execute("DELETE FROM config WHERE id = 1")
+    _invalidate_config()
+    return True
+
+
+def record_api_key_use(key_id: int, outcome: str, error: str | None, cooldown_seconds: float | None) -> None:
+    """Count one request on a key; ``outcome`` is "ok", "error", "throttled" or "quota"."""
+    now = _utc_now()
+    with _get_conn() as conn:
+        conn.execute(
+            """
+            UPDATE api_keys SET
+                requests = requests + 1,
+                failures = failures + ?,
+                throttled = throttled + ?,
+                last_error = COALESCE(?, last_error),
+                cooldown_until = COALESCE(?, cooldown_until),
+                last_used_at = ?
+            WHERE id = ?
+            """,
+            (
+                int(outcome == "error"),
+                int(outcome in ("throttled", "quota")),
+                error,
+                _utc_after(cooldown_seconds) if cooldown_seconds else None,
+                now,
+                key_id,
+            ),
+        )
+
+
+def acquire_upload(api_key: str, digest: str, now: float, hold_seconds: float) -> dict | None:
+    """Take a still-valid upload of ``digest`` for a task; the sweeper skips it until released.
+
+    Times are epoch seconds. ``hold_seconds`` bounds how long a crashed user can pin the upload.
+    """
+    with _get_conn() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            """
+            SELECT * FROM uploads
+            WHERE api_key = ? AND digest = ? AND expires_at > ?
+            ORDER BY expires_at DESC
+            LIMIT 1
+            """,
+            (api_key, digest, now),
+        ).fetchone()
+        if not row:
+            return None
+        conn.execute(
+            "UPDATE uploads SET users = users + 1, in_use_until = MAX(in_use_until, ?) WHERE file_id = ?",
+            (now + hold_seconds, row["file_id"]),
+        )
+    return dict(row)
+
+
+def add_upload(
+    api_key: str, digest: str, file_id: str, file_url: str | None, expires_at: float, in_use_until: float
+) -> None:
+    """Register an upload; ``in_use_until`` > 0 marks it taken by the task that made it."""
+    with _get_conn() as conn:
+        conn.execute(
             """
-            INSERT INTO sessions (url, title, style, remark, status, stage, created_at, updated_at)
+            INSERT OR REPLACE INTO uploads (file_id, api_key, digest, file_url, expires_at, users, in_use_until, created_at)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             """,
-            (url, None, style, remark, "pending", "download", now, now),
+            (file_id, api_key, digest, file_url, expires_at, int(in_use_until > 0), in_use_until, _utc_now()),
+        )
+
+
+def release_upload(file_id: str, forget: bool = False) -> None:
+    """Drop one user of an upload; ``forget`` also makes it due for deletion right away."""
+    with _get_conn() as conn:
+        conn.execute(
+            """
+            UPDATE uploads SET
+                users = MAX(users - 1, 0),
+                expires_at = CASE WHEN ? THEN 0 ELSE expires_at END
+            WHERE file_id = ?
+            """,
+            (int(forget), file_id),
+        )
+
+
+def claim_expired_uploads(now: float) -> list[dict]:
+    """Remove and return expired uploads that no task is using, for deletion on DashScope."""
+    with _get_conn() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(
+            "SELECT * FROM uploads WHERE expires_at <= ? AND (users = 0 OR in_use_until <= ?)",
+            (now, now),
+        ).fetchall()
+        conn.executemany("DELETE FROM uploads WHERE file_id = ?", [(row["file_id"],) for row in rows])
+    return [dict(row) for row in rows]
+
+
+def count_uploads(now: float) -> int:
+    with _get_conn() as conn:
+        return int(conn.execute("SELECT COUNT(*) FROM uploads WHERE expires_at > ?", (now,)).fetchone()[0])
+
+
+def create_session(
+    url: str, style: str | None, remark: str | None, include_joke: bool = True, profile: bool = False
+) -> int:
+    now = _utc_now()
+    with _get_conn() as conn:
+        cur = conn.execute(
+            """
+            INSERT INTO sessions (url, title, style, remark, include_joke, profile, status, stage, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (url, None, style, remark, 1 if include_joke else 0, 1 if profile else 0, "pending", "download", now, now),
         )
         session_id = int(cur.lastrowid)
         steps = [
@@ -118,8 +527,8 @@ def create_session(url: str, style: str | None, remark: str | None) -> int:
 def list_sessions() -> list[dict]:
     with _get_conn() as conn:
         rows = conn.execute(
-            """
-            SELECT id, url, title, style, remark, status, stage, created_at, updated_at
+            f"""
+            SELECT {", ".join(SUMMARY_COLUMNS)}
             FROM sessions
             ORDER BY id DESC
             """
@@ -127,10 +536,165 @@ def list_sessions() -> list[dict]:
         return [dict(row) for row in rows]
 
 
+def session_list_snapshot() -> tuple[int, list[dict]]:
+    """The current change sequence and the full session list, read in one transaction."""
+    with _get_conn() as conn:
+        conn.execute("BEGIN")
+        seq = int(conn.execute("SELECT seq FROM change_log WHERE id = 1").fetchone()[0])
+        rows = conn.execute(f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM sessions ORDER BY id DESC").fetchall()
+        return seq, [dict(row) for row in rows]
+
+
+def change_state() -> tuple[int, int]:
+    """``(seq, floor)``: the latest change number and the oldest one a delta can resume from."""
+    with _get_conn() as conn:
+        row = conn.execute("SELECT seq, floor FROM change_log WHERE id = 1").fetchone()
+        return (int(row["seq"]), int(row["floor"])) if row else (0, 0)
+
+
+def session_changes_since(seq: int) -> tuple[int, list[dict], list[int]]:
+    """Sessions upserted and deleted after ``seq``, with the sequence number they bring a reader to."""
+    with _get_conn() as conn:
+        conn.execute("BEGIN")
+        latest = int(conn.execute("SELECT seq FROM change_log WHERE id = 1").fetchone()[0])
+        if latest <= seq:
+            return latest, [], []
+        rows = conn.execute(
+            f"""
+            SELECT {", ".join(SUMMARY_COLUMNS)}
+            FROM sessions
+            WHERE change_seq > ?
+            ORDER BY id DESC
+            """,
+            (seq,),
+        ).fetchall()
+        deleted = conn.execute(
+            "SELECT session_id FROM session_tombstones WHERE change_seq > ? ORDER BY change_seq",
+            (seq,),
+        ).fetchall()
+        return latest, [dict(row) for row in rows], [int(row["session_id"]) for row in deleted]
+
+
+def iter_export_sessions(
+    status: list[str] | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    query: str | None = None,
+    batch_size: int = 50,
+):
+    """Yield sessions with transcript, note and extra notes, newest first, one batch in memory at a time.
+
+    Batches are keyset-paginated on id with a short-lived connection each, so a slow client
+    never pins a read transaction (or a connection bound to one thread) for the whole export.
+    """
+    clauses, params = [], []
+    if status:
+        clauses.append(f"status IN ({', '.join('?' for _ in status)})")
+        params.extend(status)
+    if since:
+        clauses.append("created_at >= ?")
+        params.append(since)
+    if until:
+        clauses.append("created_at <= ?")
+        params.append(until if "T" in until else f"{until}T23:59:59")
+    if query:
+        clauses.append("(title LIKE ? OR url LIKE ?)")
+        params.extend([f"%{query}%", f"%{query}%"])
+    last_id = None
+    while True:
+        where = list(clauses)
+        args = list(params)
+        if last_id is not None:
+            where.append("id < ?")
+            args.append(last_id)
+        sql = """
+            SELECT id, url, title, style, remark, status, video_key, transcript, note, created_at, updated_at
+            FROM sessions
+        """
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        args.append(batch_size)
+        with _get_conn() as conn:
+            rows = [dict(row) for row in conn.execute(sql, args).fetchall()]
+            if not rows:
+                return
+            ids = [row["id"] for row in rows]
+            notes: dict[int, list[dict]] = {}
+            for note in conn.execute(
+                f"""
+                SELECT id, session_id, style, note, created_at
+                FROM session_notes
+                WHERE status = 'completed' AND session_id IN ({', '.join('?' for _ in ids)})
+                ORDER BY id ASC
+                """,
+                ids,
+            ):
+                notes.setdefault(note["session_id"], []).append(dict(note))
+        for row in rows:
+            row["notes"] = notes.get(row["id"], [])
+            yield row
+        last_id = ids[-1]
+
+
 def get_session(session_id: int) -> dict | None:
+    """The full session row: cached metadata plus its transcript and note, read uncached."""
+    session = get_session_meta(session_id)
+    if not session:
+        return None
     with _get_conn() as conn:
-        row = conn.execute("SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
-        return dict(row) if row else None
+        row = conn.execute(
+            f"SELECT {', '.join(SESSION_TEXT_COLUMNS)} FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+    if not row:
+        return None
+    session.update(dict(row))
+    return session
+
+
+def get_session_note(session_id: int) -> str | None:
+    with _get_conn() as conn:
+        row = conn.execute("SELECT note FROM sessions WHERE id = ?", (session_id,)).fetchone()
+    return row["note"] if row else None
+
+
+def get_transcript(session_id: int) -> str:
+    with _get_conn() as conn:
+        row = conn.execute("SELECT transcript FROM sessions WHERE id = ?", (session_id,)).fetchone()
+    return (row["transcript"] if row else None) or ""
+
+
+def _meta_columns(conn: sqlite3.Connection) -> str:
+    global _session_meta_columns
+    if _session_meta_columns is None:
+        columns = [row["name"] for row in conn.execute("PRAGMA table_info(sessions)").fetchall()]
+        _session_meta_columns = ", ".join(column for column in columns if column not in SESSION_TEXT_COLUMNS)
+    return _session_meta_columns
+
+
+def get_session_meta(session_id: int) -> dict | None:
+    """Session row without transcript and note, served from the short-lived cache."""
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _session_cache.get(session_id)
+        if cached and cached[0] > now:
+            _session_cache.move_to_end(session_id)
+            _cache_stats["session_hits"] += 1
+            return dict(cached[1])
+        _cache_stats["session_misses"] += 1
+        generation = _cache_generation
+    with _get_conn() as conn:
+        row = conn.execute(f"SELECT {_meta_columns(conn)} FROM sessions WHERE id = ?", (session_id,)).fetchone()
+    if not row:
+        return None
+    session = dict(row)
+    with _cache_lock:
+        if generation == _cache_generation:
+            _session_cache[session_id] = (now + SESSION_CACHE_SECONDS, session)
+            _session_cache.move_to_end(session_id)
+            while len(_session_cache) > SESSION_CACHE_SIZE:
+                _session_cache.popitem(last=False)
+    return dict(session)
 
 
 def list_session_steps(session_id: int) -> list[dict]:
@@ -147,20 +711,102 @@ def list_session_steps(session_id: int) -> list[dict]:
         return [dict(row) for row in rows]
 
 
-def find_latest_downloaded_session(url: str) -> int | None:
+def find_latest_downloaded_session(video_key: str, exclude_session_id: int | None = None) -> dict | None:
+    with _get_conn() as conn:
+        row = conn.execute(
+            """
+            SELECT s.id, s.title, s.audio_file
+            FROM sessions s
+            JOIN session_steps st ON st.session_id = s.id
+            WHERE s.video_key = ? AND s.id != ? AND s.audio_file IS NOT NULL
+              AND st.step = 'download' AND st.status = 'completed'
+            ORDER BY s.id DESC
+            LIMIT 1
+            """,
+            (video_key, exclude_session_id or 0),
+        ).fetchone()
+        return dict(row) if row else None
+
+
+def find_latest_transcribed_session(video_key: str, exclude_session_id: int | None = None) -> dict | None:
     with _get_conn() as conn:
         row = conn.execute(
             """
-            SELECT s.id
+            SELECT s.id, s.title, s.transcript
             FROM sessions s
             JOIN session_steps st ON st.session_id = s.id
-            WHERE s.url = ? AND st.step = 'download' AND st.status = 'completed'
+            WHERE s.video_key = ? AND s.id != ? AND st.step = 'transcribe' AND st.status = 'completed'
+              AND s.transcript IS NOT NULL AND s.transcript != ''
             ORDER BY s.id DESC
             LIMIT 1
             """,
-            (url,),
+            (video_key, exclude_session_id or 0),
         ).fetchone()
-        return int(row["id"]) if row else None
+        return dict(row) if row else None
+
+
+def set_session_audio(session_id: int, audio_file: str) -> None:
+    now = _utc_now()
+    with _get_conn() as conn:
+        conn.execute(
+            """
+            UPDATE sessions
+            SET audio_file = ?, audio_used_at = ?, audio_evicted_at = NULL
+            WHERE id = ?
+            """,
+            (audio_file, now, session_id),
+        )
+    _invalidate_session(session_id)
+
+
+def touch_session_audio(session_id: int) -> None:
+    with _get_conn() as conn:
+        conn.execute("UPDATE sessions SET audio_used_at = ? WHERE id = ?", (_utc_now(), session_id))
+    _invalidate_session(session_id)
+
+
+def mark_audio_evicted(session_id: int) -> None:
+    with _get_conn() as conn:
+        conn.execute(
+            "UPDATE sessions SET audio_file = NULL, audio_evicted_at = ? WHERE id = ?",
+            (_utc_now(), session_id),
+        )
+    _invalidate_session(session_id)
+
+
+def list_audio_sessions() -> list[dict]:
+    """Session state the audio janitor needs, without transcript or note bodies."""
+    with _get_conn() as conn:
+        rows = conn.execute(
+            """
+            SELECT s.id, s.status, s.video_key, s.audio_file, s.audio_used_at, s.updated_at,
+                   st.status = 'completed' AS transcript_stored
+            FROM sessions s
+            LEFT JOIN session_steps st ON st.session_id = s.id AND st.step = 'transcribe'
+            """
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def get_video_probe(url: str) -> dict | None:
+    with _get_conn() as conn:
+        row = conn.execute("SELECT * FROM video_probes WHERE url = ?", (url,)).fetchone()
+        return dict(row) if row else None
+
+
+def save_video_probe(url: str, video_key: str, title: str | None) -> None:
+    with _get_conn() as conn:
+        conn.execute(
+            """
+            INSERT INTO video_probes (url, video_key, title, created_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(url) DO UPDATE SET
+                video_key = excluded.video_key,
+                title = excluded.title,
+                created_at = excluded.created_at
+            """,
+            (url, video_key, title, _utc_now()),
+        )
 
 
 def update_session(session_id: int, **fields: str | None) -> None:
@@ -176,6 +822,176 @@ def update_session(session_id: int, **fields: str | None) -> None:
             f"UPDATE sessions SET {assignments} WHERE id = ?",
             values,
         )
+    _invalidate_session(session_id)
+
+
+def clear_transcript(session_id: int) -> None:
+    """Drop the transcript; bumping ``transcript_gen`` tells delta readers to start over."""
+    with _get_conn() as conn:
+        conn.execute("DELETE FROM transcript_segments WHERE session_id = ?", (session_id,))
+        conn.execute(
+            "UPDATE sessions SET transcript = NULL, transcript_gen = transcript_gen + 1, updated_at = ? WHERE id = ?",
+            (_utc_now(), session_id),
+        )
+    _invalidate_session(session_id)
+
+
+def append_segments(session_id: int, segments: list[tuple[int, int, str]]) -> None:
+    """Store ``(start_ms, end_ms, text)`` segments and extend the flat transcript with their text.
+
+    ``sessions.transcript`` is kept as the newline-joined segment texts in index order, so
+    readers that only need plain text never touch the segment table.
+    """
+    segments = [(start, end, text.strip()) for start, end, text in segments if text and text.strip()]
+    if not segments:
+        return
+    with _get_conn() as conn:
+        row = conn.execute(
+            "SELECT COALESCE(MAX(idx), -1) + 1 FROM transcript_segments WHERE session_id = ?",
+            (session_id,),
+        ).fetchone()
+        first = int(row[0])
+        conn.executemany(
+            "INSERT INTO transcript_segments (session_id, idx, start_ms, end_ms, text) VALUES (?, ?, ?, ?, ?)",
+            [(session_id, first + offset, start, max(end, start), text) for offset, (start, end, text) in enumerate(segments)],
+        )
+        joined = "\n".join(text for _, _, text in segments)
+        conn.execute(
+            """
+            UPDATE sessions
+            SET transcript = CASE
+                    WHEN transcript IS NULL OR transcript = '' THEN ?
+                    ELSE transcript || char(10) || ?
+                END,
+                updated_at = ?
+            WHERE id = ?
+            """,
+            (joined, joined, _utc_now(), session_id),
+        )
+    _invalidate_session(session_id)
+
+
+def copy_transcript(source_id: int, target_id: int) -> None:
+    """Give ``target_id`` the transcript and segments of ``source_id``."""
+    with _get_conn() as conn:
+        conn.execute("DELETE FROM transcript_segments WHERE session_id = ?", (target_id,))
+        conn.execute(
+            """
+            INSERT INTO transcript_segments (session_id, idx, start_ms, end_ms, text)
+            SELECT ?, idx, start_ms, end_ms, text FROM transcript_segments WHERE session_id = ?
+            """,
+            (target_id, source_id),
+        )
+        conn.execute(
+            """
+            UPDATE sessions
+            SET transcript = (SELECT transcript FROM sessions WHERE id = ?),
+                transcript_gen = transcript_gen + 1,
+                updated_at = ?
+            WHERE id = ?
+            """,
+            (source_id, _utc_now(), target_id),
+        )
+    _invalidate_session(target_id)
+
+
+def list_segments(session_id: int, start_ms: int = 0, end_ms: int | None = None, limit: int = 500) -> list[dict]:
+    """Segments overlapping ``[start_ms, end_ms)``, using the (session_id, start_ms) index for both bounds."""
+    with _get_conn() as conn:
+        rows = conn.execute(
+            """
+            SELECT idx, start_ms, end_ms, text
+            FROM transcript_segments
+            WHERE session_id = ?
+              AND start_ms >= COALESCE(
+                  (SELECT MAX(start_ms) FROM transcript_segments WHERE session_id = ? AND start_ms <= ?), 0)
+              AND start_ms < ?
+              AND end_ms >= ?
+            ORDER BY start_ms, idx
+            LIMIT ?
+            """,
+            (session_id, session_id, start_ms, end_ms if end_ms is not None else 2**62, start_ms, limit),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def find_segment_at(session_id: int, position_ms: int) -> dict | None:
+    """The last segment starting at or before ``position_ms`` (the one a seek lands in)."""
+    with _get_conn() as conn:
+        row = conn.execute(
+            """
+            SELECT idx, start_ms, end_ms, text
+            FROM transcript_segments
+            WHERE session_id = ? AND start_ms <= ?
+            ORDER BY start_ms DESC, idx DESC
+            LIMIT 1
+            """,
+            (session_id, position_ms),
+        ).fetchone()
+        return dict(row) if row else None
+
+
+def get_transcript_tail(session_id: int, offset: int) -> tuple[int, str, int] | None:
+    """Return ``(length, text after offset, generation)`` of the stored transcript, in characters.
+
+    The generation changes whenever the transcript is replaced rather than extended.
+    """
+    with _get_conn() as conn:
+        row = conn.execute(
+            """
+            SELECT length(COALESCE(transcript, '')) AS size, substr(COALESCE(transcript, ''), ?) AS tail,
+                   transcript_gen
+            FROM sessions
+            WHERE id = ?
+            """,
+            (offset + 1, session_id),
+        ).fetchone()
+        return (int(row["size"]), row["tail"], int(row["transcript_gen"])) if row else None
+
+
+def create_notes(session_id: int, styles: list[str | None], remark: str | None, include_joke: bool = True) -> list[int]:
+    now = _utc_now()
+    with _get_conn() as conn:
+        ids = []
+        for style in styles:
+            cur = conn.execute(
+                """
+                INSERT INTO session_notes (session_id, style, remark, include_joke, status, created_at, updated_at)
+                VALUES (?, ?, ?, ?, 'pending', ?, ?)
+                """,
+                (session_id, style, remark, 1 if include_joke else 0, now, now),
+            )
+            ids.append(int(cur.lastrowid))
+        return ids
+
+
+def list_session_notes(session_id: int) -> list[dict]:
+    with _get_conn() as conn:
+        rows = conn.execute(
+            """
+            SELECT id, session_id, style, remark, include_joke, status, note, error, created_at, updated_at
+            FROM session_notes
+            WHERE session_id = ?
+            ORDER BY id ASC
+            """,
+            (session_id,),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def update_note(note_id: int, **fields: str | None) -> None:
+    if not fields:
+        return
+    fields["updated_at"] = _utc_now()
+    keys = list(fields.keys())
+    assignments = ", ".join([f"{key} = ?" for key in keys])
+    values = [fields[key] for key in keys]
+    values.append(note_id)
+    with _get_conn() as conn:
+        conn.execute(
+            f"UPDATE session_notes SET {assignments} WHERE id = ?",
+            values,
+        )
 
 
 def update_step(session_id: int, step: str, status: str, message: str | None = None) -> None:
@@ -191,6 +1007,251 @@ def update_step(session_id: int, step: str, status: str, message: str | None = N
         )
 
 
+def claim_next_session(worker_id: str, lease_seconds: float, max_attempts: int) -> dict | None:
+    """Atomically lease the oldest queued session (or one whose lease expired)."""
+    # Only rows the claim changed are dropped from the cache, and only after the commit;
+    # empty polls leave it alone.
+    touched: list[int] = []
+    try:
+        return _claim_next_session(worker_id, lease_seconds, max_attempts, touched)
+    finally:
+        for session_id in touched:
+            _invalidate_session(session_id)
+
+
+def _claim_next_session(
+    worker_id: str, lease_seconds: float, max_attempts: int, touched: list[int]
+) -> dict | None:
+    now = _utc_now()
+    with _get_conn() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        while True:
+            row = conn.execute(
+                """
+                SELECT id, attempts
+                FROM sessions
+                WHERE (
+                    status IN ('pending', 'running')
+                    AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+                ) OR (
+                    status = 'waiting'
+                    AND NOT EXISTS (
+                        SELECT 1
+                        FROM flights f
+                        JOIN sessions l ON l.id = f.session_id
+                        WHERE f.key = sessions.waiting_on AND f.status = 'running'
+                          AND l.status IN ('pending', 'running') AND l.lease_expires_at > ?
+                    )
+                )
+                ORDER BY id ASC
+                LIMIT 1
+                """,
+                (now, now),
+            ).fetchone()
+            if not row:
+                return None
+            session_id = int(row["id"])
+            touched.append(session_id)
+            if row["attempts"] >= max_attempts:
+                message = f"gave up after {row['attempts']} attempts"
+                conn.execute(
+                    """
+                    UPDATE sessions
+                    SET status = 'failed', error = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+                    WHERE id = ?
+                    """,
+                    (message, now, session_id),
+                )
+                continue
+            conn.execute(
+                """
+                UPDATE sessions
+                SET lease_owner = ?, lease_expires_at = ?, attempts = attempts + 1,
+                    status = CASE WHEN status = 'waiting' THEN 'running' ELSE status END,
+                    waiting_on = NULL
+                WHERE id = ?
+                """,
+                (worker_id, _utc_after(lease_seconds), session_id),
+            )
+            claimed = conn.execute("SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            return dict(claimed)
+
+
+def park_session(session_id: int, flight_key: str) -> None:
+    """Release a session that waits on another session's flight until that flight ends.
+
+    The parked run does not count as an attempt; claim_next_session picks the session up
+    again once the flight is gone or its leader is no longer alive.
+    """
+    with _get_conn() as conn:
+        conn.execute(
+            """
+            UPDATE sessions
+            SET status = 'waiting', waiting_on = ?, lease_owner = NULL, lease_expires_at = NULL,
+                attempts = MAX(attempts - 1, 0), updated_at = ?
+            WHERE id = ?
+            """,
+            (flight_key, _utc_now(), session_id),
+        )
+    _invalidate_session(session_id)
+
+
+def renew_session_lease(session_id: int, worker_id: str, lease_seconds: float) -> bool:
+    with _get_conn() as conn:
+        cur = conn.execute(
+            "UPDATE sessions SET lease_expires_at = ? WHERE id = ? AND lease_owner = ?",
+            (_utc_after(lease_seconds), session_id, worker_id),
+        )
+    _invalidate_session(session_id)
+    return cur.rowcount > 0
+
+
+def release_session_lease(session_id: int, worker_id: str) -> None:
+    with _get_conn() as conn:
+        conn.execute(
+            """
+            UPDATE sessions
+            SET lease_owner = NULL, lease_expires_at = NULL
+            WHERE id = ? AND lease_owner = ?
+            """,
+            (session_id, worker_id),
+        )
+    _invalidate_session(session_id)
+
+
+def claim_next_note(worker_id: str, lease_seconds: float, max_attempts: int) -> dict | None:
+    """Atomically lease the oldest queued note job, mirroring claim_next_session."""
+    now = _utc_now()
+    with _get_conn() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        while True:
+            row = conn.execute(
+                """
+                SELECT id, attempts
+                FROM session_notes
+                WHERE status IN ('pending', 'running')
+                  AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+                ORDER BY id ASC
+                LIMIT 1
+                """,
+                (now,),
+            ).fetchone()
+            if not row:
+                return None
+            note_id = int(row["id"])
+            if row["attempts"] >= max_attempts:
+                message = f"gave up after {row['attempts']} attempts"
+                conn.execute(
+                    """
+                    UPDATE session_notes
+                    SET status = 'failed', error = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+                    WHERE id = ?
+                    """,
+                    (message, now, note_id),
+                )
+                continue
+            conn.execute(
+                """
+                UPDATE session_notes
+                SET lease_owner = ?, lease_expires_at = ?, attempts = attempts + 1
+                WHERE id = ?
+                """,
+                (worker_id, _utc_after(lease_seconds), note_id),
+            )
+            claimed = conn.execute("SELECT * FROM session_notes WHERE id = ?", (note_id,)).fetchone()
+            return dict(claimed)
+
+
+def renew_note_lease(note_id: int, worker_id: str, lease_seconds: float) -> bool:
+    with _get_conn() as conn:
+        cur = conn.execute(
+            "UPDATE session_notes SET lease_expires_at = ? WHERE id = ? AND lease_owner = ?",
+            (_utc_after(lease_seconds), note_id, worker_id),
+        )
+    return cur.rowcount > 0
+
+
+def release_note_lease(note_id: int, worker_id: str) -> None:
+    with _get_conn() as conn:
+        conn.execute(
+            """
+            UPDATE session_notes
+            SET lease_owner = NULL, lease_expires_at = NULL
+            WHERE id = ? AND lease_owner = ?
+            """,
+            (note_id, worker_id),
+        )
+
+
+def join_flight(key: str, session_id: int) -> dict:
+    """Lead the work identified by ``key``, or attach to whoever already leads or finished it.
+
+    Returns ``{"session_id", "status"}``: our own id with status ``running`` means we lead.
+    A leader only counts while its session is active and its lease is current, so work
+    abandoned by a crashed worker is taken over by the next session that asks.
+    """
+    now = _utc_now()
+    with _get_conn() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            """
+            SELECT f.session_id, f.status, f.updated_at, s.status AS session_status, s.lease_expires_at
+            FROM flights f
+            JOIN sessions s ON s.id = f.session_id
+            WHERE f.key = ?
+            """,
+            (key,),
+        ).fetchone()
+        if row and row["session_id"] != session_id:
+            leader_alive = row["session_status"] in ("pending", "running") and (row["lease_expires_at"] or "") > now
+            fresh = row["status"] == "done" and row["updated_at"] > _utc_after(-FLIGHT_DONE_SECONDS)
+            if fresh or leader_alive:
+                return {"session_id": int(row["session_id"]), "status": row["status"]}
+        conn.execute(
+            """
+            INSERT INTO flights (key, session_id, status, created_at, updated_at)
+            VALUES (?, ?, 'running', ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                session_id = excluded.session_id,
+                status = 'running',
+                updated_at = excluded.updated_at
+            """,
+            (key, session_id, now, now),
+        )
+        return {"session_id": session_id, "status": "running"}
+
+
+def finish_flight(key: str, session_id: int) -> None:
+    """Mark the flight finished; it answers identical work for FLIGHT_DONE_SECONDS.
+
+    That window lets sessions parked on the flight pick up its result when they are claimed
+    again, without turning flights into a permanent cache. Older finished flights are dropped.
+    """
+    with _get_conn() as conn:
+        conn.execute(
+            "UPDATE flights SET status = 'done', updated_at = ? WHERE key = ? AND session_id = ?",
+            (_utc_now(), key, session_id),
+        )
+        conn.execute(
+            "DELETE FROM flights WHERE status = 'done' AND updated_at <= ?",
+            (_utc_after(-FLIGHT_DONE_SECONDS),),
+        )
+
+
+def release_flights(session_id: int) -> None:
+    """Drop the unfinished flights a session leads, letting waiting sessions take over."""
+    with _get_conn() as conn:
+        conn.execute("DELETE FROM flights WHERE session_id = ? AND status = 'running'", (session_id,))
+
+
 def delete_session(session_id: int) -> None:
     with _get_conn() as conn:
         conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        cutoff = conn.execute(
+            "SELECT change_seq FROM session_tombstones ORDER BY change_seq DESC LIMIT 1 OFFSET ?",
+            (TOMBSTONE_KEEP,),
+        ).fetchone()
+        if cutoff:
+            conn.execute("DELETE FROM session_tombstones WHERE change_seq <= ?", (cutoff[0],))
+            conn.execute("UPDATE change_log SET floor = MAX(floor, ?) WHERE id = 1", (cutoff[0],))
+    _invalidate_session(session_id)
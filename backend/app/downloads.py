@@ -0,0 +1,100 @@
+import contextlib
+import os
+import shlex
+import shutil
+import threading
+from collections.abc import Callable, Iterator
+from urllib.parse import urlparse
+
+from .video_id import BILIBILI_HOSTS, YOUTUBE_HOSTS
+
+# Fragments fetched in parallel for DASH/HLS streams (yt-dlp concurrent_fragment_downloads).
+FRAGMENT_CONCURRENCY = int(os.getenv("QKNOTE_DL_FRAGMENTS", "4"))
+# Optional external downloader, e.g. "aria2c"; ignored when the binary is not on PATH.
+EXTERNAL_DOWNLOADER = os.getenv("QKNOTE_DL_EXTERNAL", "").strip()
+EXTERNAL_DOWNLOADER_ARGS = os.getenv("QKNOTE_DL_EXTERNAL_ARGS", "-x 8 -s 8 -k 1M")
+MAX_DOWNLOADS = int(os.getenv("QKNOTE_DL_MAX", "3"))
+MAX_PER_HOST = int(os.getenv("QKNOTE_DL_PER_HOST", "2"))
+# Bandwidth budget for this process in MB/s (0 = unlimited), split between the downloads
+# running when each one starts. A soft target: see slot().
+RATE_LIMIT_BYTES = int(float(os.getenv("QKNOTE_DL_RATE_MB", "0")) * 1024 * 1024)
+
+_lock = threading.Lock()
+_global_slots = threading.BoundedSemaphore(max(MAX_DOWNLOADS, 1))
+_host_slots: dict[str, threading.BoundedSemaphore] = {}
+_active: dict[str, int] = {}
+_stats = {"started": 0, "completed": 0, "failed": 0, "waited": 0}
+
+
+def host_group(url: str) -> str:
+    """Group hosts that share a rate limit (all Bilibili / YouTube domains count as one)."""
+    raw = (url or "").strip()
+    host = (urlparse(raw if "://" in raw else f"https://{raw}").hostname or "").lower()
+    for name, domains in (("bilibili", BILIBILI_HOSTS), ("youtube", YOUTUBE_HOSTS)):
+        if any(host == domain or host.endswith(f".{domain}") for domain in domains):
+            return name
+    if "/" not in raw and "." not in raw:
+        return "bilibili"  # bare BV/av ids
+    return host or "unknown"
+
+
+def ydl_options() -> dict:
+    options: dict = {"concurrent_fragment_downloads": max(FRAGMENT_CONCURRENCY, 1)}
+    if EXTERNAL_DOWNLOADER:
+        if shutil.which(EXTERNAL_DOWNLOADER):
+            options["external_downloader"] = {"default": EXTERNAL_DOWNLOADER}
+            options["external_downloader_args"] = {EXTERNAL_DOWNLOADER: shlex.split(EXTERNAL_DOWNLOADER_ARGS)}
+        else:
+            print(f"[downloads] external downloader {EXTERNAL_DOWNLOADER} not found; using yt-dlp native")
+    return options
+
+
+@contextlib.contextmanager
+def slot(url: str, on_wait: Callable[[], None] | None = None) -> Iterator[dict]:
+    """Hold a download slot for ``url`` and yield extra yt-dlp options for this download.
+
+    The per-host slot is taken before the global one so a busy host cannot hold global
+    slots while it waits. Each download gets the budget divided by the downloads running
+    as it starts, so one running alone uses the whole budget. yt-dlp cannot lower the
+    limit of a download already running, so while an earlier download keeps its larger
+    share the total can overshoot (at most 1 + 1/2 + ... + 1/MAX_DOWNLOADS times the budget).
+    """
+    group = host_group(url)
+    with _lock:
+        host_slots = _host_slots.setdefault(group, threading.BoundedSemaphore(max(MAX_PER_HOST, 1)))
+    waited = False
+    for semaphore in (host_slots, _global_slots):
+        if not semaphore.acquire(blocking=False):
+            if not waited and on_wait:
+                on_wait()
+            waited = True
+            semaphore.acquire()
+    with _lock:
+        _active[group] = _active.get(group, 0) + 1
+        _stats["started"] += 1
+        _stats["waited"] += int(waited)
+        running = sum(_active.values())
+    options = ydl_options()
+    if RATE_LIMIT_BYTES > 0:
+        options["ratelimit"] = max(RATE_LIMIT_BYTES // running, 64 * 1024)
+    ok = False
+    try:
+        yield options
+        ok = True
+    finally:
+        with _lock:
+            _active[group] -= 1
+            _stats["completed" if ok else "failed"] += 1
+        _global_slots.release()
+        host_slots.release()
+
+
+def stats() -> dict:
+    with _lock:
+        return {
+            **_stats,
+            "active": {group: count for group, count in _active.items() if count},
+            "max_downloads": MAX_DOWNLOADS,
+            "max_per_host": MAX_PER_HOST,
+            "rate_limit_bytes": RATE_LIMIT_BYTES,
+        }
@@ -0,0 +1,94 @@
+import io
+import json
+import re
+import zipfile
+from collections.abc import Iterable, Iterator
+
+_SLUG_RE = re.compile(r"[^\w\-]+", re.UNICODE)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, unseekable file for zipfile: bytes are collected until drained.
+
+    Because it cannot seek, zipfile writes each entry's sizes in a data descriptor after
+    the data, so entries never need to be held in memory or patched afterwards.
+    """
+
+    def __init__(self) -> None:
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def session_dir(session: dict) -> str:
+    slug = _SLUG_RE.sub("-", session.get("title") or "").strip("-")[:60]
+    return f"{session['id']:06d}-{slug}" if slug else f"{session['id']:06d}"
+
+
+def note_markdown(session: dict, note: str, style: str | None) -> str:
+    lines = [f"# {session.get('title') or session['url']}", ""]
+    lines.append(f"- Source: {session['url']}")
+    if style:
+        lines.append(f"- Style: {style}")
+    lines.append(f"- Created: {session['created_at']}")
+    return "\n".join(lines) + "\n\n" + note.strip() + "\n"
+
+
+def transcript_markdown(session: dict) -> str:
+    title = session.get("title") or session["url"]
+    return f"# {title} (transcript)\n\n- Source: {session['url']}\n\n{(session['transcript'] or '').strip()}\n"
+
+
+def session_files(session: dict) -> Iterator[tuple[str, str]]:
+    base = session_dir(session)
+    if session.get("note"):
+        yield f"{base}/note.md", note_markdown(session, session["note"], session.get("style"))
+    for extra in session.get("notes") or []:
+        if extra.get("note"):
+            style = extra.get("style") or "default"
+            yield f"{base}/note-{style}-{extra['id']}.md", note_markdown(session, extra["note"], style)
+    if session.get("transcript"):
+        yield f"{base}/transcript.md", transcript_markdown(session)
+
+
+def iter_zip(sessions: Iterable[dict]) -> Iterator[bytes]:
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for session in sessions:
+            for name, content in session_files(session):
+                archive.writestr(name, content)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    yield sink.drain()
+
+
+def iter_ndjson(sessions: Iterable[dict]) -> Iterator[bytes]:
+    for session in sessions:
+        record = {
+            "id": session["id"],
+            "url": session["url"],
+            "title": session.get("title"),
+            "style": session.get("style"),
+            "status": session.get("status"),
+            "video_key": session.get("video_key"),
+            "created_at": session.get("created_at"),
+            "updated_at": session.get("updated_at"),
+            "note": session.get("note"),
+            "transcript": session.get("transcript"),
+            "notes": [
+                {"id": extra["id"], "style": extra.get("style"), "note": extra.get("note")}
+                for extra in session.get("notes") or []
+            ],
+        }
+        yield (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
@@ -0,0 +1,150 @@
+import os
+import re
+import shutil
+import threading
+from datetime import datetime
+
+from . import db
+from .qwen_client import sweep_uploads
+
+ENABLED = os.getenv("QKNOTE_JANITOR", "1") != "0"
+AUDIO_BUDGET_BYTES = int(float(os.getenv("QKNOTE_AUDIO_BUDGET_MB", "2048")) * 1024 * 1024)
+INTERVAL_SECONDS = float(os.getenv("QKNOTE_JANITOR_INTERVAL", "300"))
+ACTIVE_STATUSES = {"pending", "running", "waiting"}
+
+_AUDIO_RE = re.compile(r"(\d+)\.\w+")
+_CHUNKS_RE = re.compile(r"(\d+)_chunks")
+
+_lock = threading.Lock()
+_stats = {
+    "runs": 0,
+    "last_run_at": None,
+    "audio_bytes": 0,
+    "budget_bytes": AUDIO_BUDGET_BYTES,
+    "chunk_dirs_removed": 0,
+    "chunk_bytes_reclaimed": 0,
+    "audio_evicted": 0,
+    "audio_bytes_reclaimed": 0,
+}
+
+
+def stats() -> dict:
+    with _lock:
+        return dict(_stats)
+
+
+def run_once() -> dict:
+    """One janitor pass: drop finished chunk directories, then evict cold audio over budget."""
+    sessions = {row["id"]: row for row in db.list_audio_sessions()}
+    # Sessions created after the snapshot may already be writing files; leave those alone.
+    newest = max(sessions, default=0)
+    chunk_dirs = chunk_bytes = 0
+    audio_files: list[tuple[int, str, int]] = []
+    if os.path.isdir(db.AUDIO_DIR):
+        for entry in os.scandir(db.AUDIO_DIR):
+            chunk_match = _CHUNKS_RE.fullmatch(entry.name)
+            if chunk_match and entry.is_dir():
+                session_id = int(chunk_match.group(1))
+                session = sessions.get(session_id)
+                if session_id > newest:
+                    continue
+                if session and session["status"] in ACTIVE_STATUSES and not session["transcript_stored"]:
+                    continue
+                size = _tree_size(entry.path)
+                shutil.rmtree(entry.path, ignore_errors=True)
+                chunk_dirs += 1
+                chunk_bytes += size
+                continue
+            audio_match = _AUDIO_RE.fullmatch(entry.name)
+            if audio_match and entry.is_file() and int(audio_match.group(1)) <= newest:
+                audio_files.append((int(audio_match.group(1)), entry.path, entry.stat().st_size))
+
+    total = sum(size for _, _, size in audio_files)
+    evicted = evicted_bytes = 0
+    if total > AUDIO_BUDGET_BYTES:
+        for session_id, path, size in _eviction_order(audio_files, sessions):
+            if total <= AUDIO_BUDGET_BYTES:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            if session_id in sessions:
+                db.mark_audio_evicted(session_id)
+            total -= size
+            evicted += 1
+            evicted_bytes += size
+
+    if chunk_dirs or evicted:
+        print(
+            f"[janitor] removed {chunk_dirs} chunk dirs ({chunk_bytes} bytes), "
+            f"evicted {evicted} audio files ({evicted_bytes} bytes)"
+        )
+    with _lock:
+        _stats["runs"] += 1
+        _stats["last_run_at"] = datetime.utcnow().isoformat(timespec="seconds")
+        _stats["audio_bytes"] = total
+        _stats["chunk_dirs_removed"] += chunk_dirs
+        _stats["chunk_bytes_reclaimed"] += chunk_bytes
+        _stats["audio_evicted"] += evicted
+        _stats["audio_bytes_reclaimed"] += evicted_bytes
+        return dict(_stats)
+
+
+def _eviction_order(audio_files: list[tuple[int, str, int]], sessions: dict[int, dict]) -> list[tuple[int, str, int]]:
+    """Orphans first, then extra copies of a video, then last copies; least recently used first.
+
+    Files still backing an active session are never evicted. Keeping the newest copy of each
+    video until last preserves the URL cache for as long as the budget allows.
+    """
+    copies: dict[str, list[int]] = {}
+    for session_id, _, _ in audio_files:
+        session = sessions.get(session_id)
+        if session and session["video_key"]:
+            copies.setdefault(session["video_key"], []).append(session_id)
+
+    ranked = []
+    for session_id, path, size in audio_files:
+        session = sessions.get(session_id)
+        if session is None:
+            ranked.append(((0, ""), (session_id, path, size)))
+            continue
+        if session["status"] in ACTIVE_STATUSES:
+            continue
+        siblings = copies.get(session["video_key"] or "", [session_id])
+        is_last_copy = session_id == max(siblings)
+        last_used = session["audio_used_at"] or session["updated_at"] or ""
+        ranked.append(((2 if is_last_copy else 1, last_used), (session_id, path, size)))
+    ranked.sort(key=lambda item: item[0])
+    return [item for _, item in ranked]
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _run_forever(stop_event: threading.Event) -> None:
+    while not stop_event.is_set():
+        try:
+            run_once()
+        except Exception as exc:
+            print(f"[janitor] pass failed: {exc}")
+        try:
+            # Workers sweep between jobs; this covers API-only processes too (e.g. key validation uploads).
+            sweep_uploads()
+        except Exception as exc:
+            print(f"[janitor] upload sweep failed: {exc}")
+        stop_event.wait(INTERVAL_SECONDS)
+
+
+def start(stop_event: threading.Event) -> threading.Thread:
+    thread = threading.Thread(target=_run_forever, args=(stop_event,), name="qknote-janitor", daemon=True)
+    thread.start()
+    return thread
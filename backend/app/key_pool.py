@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from datetime import datetime
+from typing import Any, TypeVar
+
+from . import db
+
+# Cooldown after a rate-limit response; doubles while the key keeps getting throttled.
+THROTTLE_COOLDOWN_SECONDS = float(os.getenv("QKNOTE_KEY_THROTTLE_COOLDOWN", "30"))
+# Cooldown after a quota, billing or auth rejection, which does not clear up in seconds.
+QUOTA_COOLDOWN_SECONDS = float(os.getenv("QKNOTE_KEY_QUOTA_COOLDOWN", "1800"))
+# How long a request waits for a key to come back when every key is cooling down.
+MAX_WAIT_SECONDS = float(os.getenv("QKNOTE_KEY_MAX_WAIT", "60"))
+# A key that failed every recent request ranks like one with this many requests in flight.
+ERROR_WEIGHT = 4.0
+OUTCOME_WINDOW = 50
+
+# Checked in order: "Throttling.AllocationQuota" is a quota error, not a passing rate limit.
+_QUOTA_MARKERS = ("AllocationQuota", "Arrearage", "FreeTierOnly", "InvalidApiKey", "error 401", "error 403")
+_THROTTLE_MARKERS = ("Throttling", "RateQuota", "error 429")
+# Failures caused by the audio itself say nothing about the key.
+_BENIGN_MARKERS = ("SUCCESS_WITH_NO_VALID_FRAGMENT", "empty transcript")
+
+T = TypeVar("T")
+
+_lock = threading.Lock()
+_in_flight: dict[int, int] = {}
+_outcomes: dict[int, deque[bool]] = {}
+_throttle_streak: dict[int, int] = {}
+_last_picked: dict[int, float] = {}
+_stats = {"leases": 0, "retries": 0, "waits": 0}
+
+
+def mask(api_key: str) -> str:
+    return f"{api_key[:4]}****{api_key[-4:]}" if len(api_key) >= 8 else "****"
+
+
+def classify(exc: BaseException) -> str:
+    message = str(exc)
+    if any(marker in message for marker in _QUOTA_MARKERS):
+        return "quota"
+    if any(marker in message for marker in _THROTTLE_MARKERS):
+        return "throttled"
+    if any(marker in message for marker in _BENIGN_MARKERS):
+        return "ok"
+    return "error"
+
+
+def call(func: Callable[[str], T]) -> T:
+    """Run ``func(api_key)`` on the least loaded usable key of the pool.
+
+    A key that is throttled or out of quota is taken out of rotation for a while and the
+    call moves on to a key it has not tried yet; other errors are raised as they are.
+    """
+    tried: set[int] = set()
+    key = _acquire(tried)
+    while True:
+        tried.add(key["id"])
+        try:
+            result = func(key["api_key"])
+        except Exception as exc:
+            outcome = classify(exc)
+            _release(key, outcome, str(exc)[:500])
+            if outcome not in ("throttled", "quota"):
+                raise
+            try:
+                key = _acquire(tried)
+            except RuntimeError:
+                raise exc from None
+            with _lock:
+                _stats["retries"] += 1
+            continue
+        _release(key, "ok", None)
+        return result
+
+
+def key_summaries() -> list[dict[str, Any]]:
+    """Masked pool members with their stored counters and this process's load."""
+    keys = db.list_api_keys()
+    with _lock:
+        return [
+            {
+                "id": key["id"],
+                "label": key["label"],
+                "api_key_masked": mask(key["api_key"]),
+                "requests": key["requests"],
+                "failures": key["failures"],
+                "throttled": key["throttled"],
+                "cooldown_until": key["cooldown_until"] if _cooling(key) else None,
+                "last_error": key["last_error"],
+                "last_used_at": key["last_used_at"],
+                "in_flight": _in_flight.get(key["id"], 0),
+                "recent_error_rate": round(_error_rate(key["id"]), 3),
+            }
+            for key in keys
+        ]
+
+
+def stats() -> dict[str, Any]:
+    keys = key_summaries()
+    with _lock:
+        return {**_stats, "keys": keys}
+
+
+def _acquire(exclude: set[int]) -> dict:
+    deadline = time.monotonic() + MAX_WAIT_SECONDS
+    waited = False
+    while True:
+        keys = [key for key in db.list_api_keys() if key["id"] not in exclude]
+        if not keys:
+            raise RuntimeError("missing api key" if not exclude else "no other api key to try")
+        ready = [key for key in keys if not _cooling(key)]
+        if ready:
+            with _lock:
+                # Ties go to the key picked longest ago, so an idle pool rotates round-robin.
+                key = min(ready, key=lambda item: (_load(item["id"]), _last_picked.get(item["id"], 0.0)))
+                _in_flight[key["id"]] = _in_flight.get(key["id"], 0) + 1
+                _last_picked[key["id"]] = time.monotonic()
+                _stats["leases"] += 1
+                _stats["waits"] += int(waited)
+            return key
+        soonest = min(key["cooldown_until"] for key in keys)
+        delay = (datetime.fromisoformat(soonest) - datetime.utcnow()).total_seconds()
+        if time.monotonic() + delay > deadline:
+            raise RuntimeError(f"all api keys are throttled until {soonest}")
+        waited = True
+        time.sleep(max(delay, 0.5))
+
+
+def _release(key: dict, outcome: str, error: str | None) -> None:
+    key_id = key["id"]
+    with _lock:
+        _in_flight[key_id] -= 1
+        _outcomes.setdefault(key_id, deque(maxlen=OUTCOME_WINDOW)).append(outcome == "ok")
+        streak = _throttle_streak[key_id] = _throttle_streak.get(key_id, 0) + 1 if outcome == "throttled" else 0
+    cooldown = None
+    if outcome == "quota":
+        cooldown = QUOTA_COOLDOWN_SECONDS
+    elif outcome == "throttled":
+        cooldown = min(THROTTLE_COOLDOWN_SECONDS * 2 ** (streak - 1), QUOTA_COOLDOWN_SECONDS)
+    if cooldown:
+        print(f"[keys] {mask(key['api_key'])} {outcome}; out of rotation for {cooldown:.0f}s")
+    db.record_api_key_use(key_id, outcome, error if outcome != "ok" else None, cooldown)
+
+
+def _cooling(key: dict) -> bool:
+    return (key["cooldown_until"] or "") > datetime.utcnow().isoformat(timespec="seconds")
+
+
+def _load(key_id: int) -> float:
+    return _in_flight.get(key_id, 0) + ERROR_WEIGHT * _error_rate(key_id)
+
+
+def _error_rate(key_id: int) -> float:
+    outcomes = _outcomes.get(key_id)
+    if not outcomes:
+        return 0.0
+    return 1 - sum(outcomes) / len(outcomes)
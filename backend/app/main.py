@@ -4,21 +4,24 @@ import json
 import os
 import re
 import shutil
+import threading
+from datetime import datetime
 from pathlib import Path
 
-from fastapi import BackgroundTasks, FastAPI, HTTPException, Request
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 
-from . import db
-from .pipeline import process_session
-from .qwen_client import QwenClient
+from . import db, downloads, export, janitor, key_pool, profiling, worker
+from .qwen_client import QwenClient, hedge_stats, sweep_uploads, upload_stats
 
 DEFAULT_AUDIO_MODEL = "qwen3-asr-flash-filetrans"
 DEFAULT_TEXT_MODEL = "qwen-max-latest"
 
 app = FastAPI()
+_worker_stop = threading.Event()
+_janitor_stop = threading.Event()
 
 app.add_middleware(
     CORSMiddleware,
@@ -29,8 +32,20 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def profiling_toggle(request: Request, call_next):
+    if request.headers.get(profiling.HEADER) != "1":
+        return await call_next(request)
+    token = profiling.request_profiling.set(True)
+    try:
+        return await call_next(request)
+    finally:
+        profiling.request_profiling.reset(token)
+
+
 class ConfigIn(BaseModel):
     api_key: str = Field(..., min_length=10)
+    label: str | None = None
 
 
 class SessionIn(BaseModel):
@@ -40,6 +55,13 @@ class SessionIn(BaseModel):
     include_joke: bool = True
 
 
+class NoteIn(BaseModel):
+    style: str | None = None
+    styles: list[str] | None = None
+    remark: str | None = None
+    include_joke: bool = True
+
+
 def _normalize_api_key(value: str) -> str:
     cleaned = value.strip()
     if cleaned.lower().startswith("bearer "):
@@ -77,6 +99,47 @@ def _format_dashscope_error(exc: Exception) -> str:
 @app.on_event("startup")
 def on_startup() -> None:
     db.init_db()
+    if worker.EMBEDDED_WORKERS > 0:
+        worker.start_workers(worker.EMBEDDED_WORKERS, _worker_stop)
+    if janitor.ENABLED:
+        janitor.start(_janitor_stop)
+
+
+@app.on_event("shutdown")
+def on_shutdown() -> None:
+    _worker_stop.set()
+    _janitor_stop.set()
+    worker.notify()
+    try:
+        # Unexpired uploads stay registered in the database for reuse after a restart.
+        sweep_uploads()
+    except Exception as exc:
+        print(f"[shutdown] upload sweep failed: {exc}")
+
+
+@app.get("/api/stats")
+def get_stats() -> dict:
+    return {
+        "cache": db.cache_stats(),
+        "janitor": janitor.stats(),
+        "uploads": upload_stats(),
+        "hedging": hedge_stats(),
+        "downloads": downloads.stats(),
+        "keys": key_pool.stats(),
+    }
+
+
+@app.get("/api/debug/profiles")
+def list_profiles() -> dict:
+    return {"enabled": profiling.ENABLED, "items": profiling.list_profiles()}
+
+
+@app.get("/api/debug/profiles/{path:path}")
+def download_profile(path: str) -> FileResponse:
+    resolved = profiling.resolve_profile(path)
+    if not resolved:
+        raise HTTPException(status_code=404, detail="not found")
+    return FileResponse(resolved, filename=os.path.basename(resolved))
 
 
 @app.get("/api/config")
@@ -85,11 +148,10 @@ def get_config() -> dict:
     if not config:
         return {"has_key": False}
 
-    api_key = config["api_key"]
-    masked = f"{api_key[:4]}****{api_key[-4:]}" if len(api_key) >= 8 else "****"
     return {
         "has_key": True,
-        "api_key_masked": masked,
+        "api_key_masked": key_pool.mask(config["api_key"]),
+        "keys": key_pool.key_summaries(),
     }
 
 
@@ -116,56 +178,142 @@ def save_config(payload: ConfigIn) -> dict:
         print(f"[save_config] validation failed: {exc}")
         raise HTTPException(status_code=400, detail=_format_dashscope_error(exc))
 
+    # Saving a key adds it to the pool; the config row keeps the models and the newest key.
+    key_id = db.add_api_key(api_key, (payload.label or "").strip() or None)
     db.upsert_config(api_key, DEFAULT_AUDIO_MODEL, DEFAULT_TEXT_MODEL)
+    return {"ok": True, "id": key_id}
+
+
+@app.delete("/api/config/keys/{key_id}")
+def delete_api_key(key_id: int) -> dict:
+    if not db.delete_api_key(key_id):
+        raise HTTPException(status_code=404, detail="not found")
     return {"ok": True}
 
 
 @app.post("/api/sessions")
-def create_session(payload: SessionIn, background_tasks: BackgroundTasks) -> dict:
+@profiling.profiled("create_session")
+def create_session(payload: SessionIn) -> dict:
     config = db.get_config()
     if not config:
         raise HTTPException(status_code=400, detail="missing api key")
 
-    session_id = db.create_session(payload.url, payload.style, payload.remark)
-    background_tasks.add_task(process_session, session_id, payload.include_joke)
+    # The profiling header on this request also profiles the session's pipeline stages.
+    session_id = db.create_session(
+        payload.url, payload.style, payload.remark, payload.include_joke, profiling.request_profiling.get()
+    )
+    worker.notify()
     return {"id": session_id}
 
 
 @app.get("/api/sessions")
+@profiling.profiled("list_sessions")
 def list_sessions() -> dict:
     return {"items": db.list_sessions()}
 
 
+@app.get("/api/export")
+def export_sessions(
+    format: str = "zip",
+    status: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    q: str | None = None,
+) -> StreamingResponse:
+    if format not in {"zip", "ndjson"}:
+        raise HTTPException(status_code=400, detail="format must be zip or ndjson")
+    statuses = [item.strip() for item in (status or "").split(",") if item.strip()]
+    sessions = db.iter_export_sessions(statuses or None, since or None, until or None, (q or "").strip() or None)
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    if format == "zip":
+        body, media_type, filename = export.iter_zip(sessions), "application/zip", f"qknote-export-{stamp}.zip"
+    else:
+        body, media_type, filename = export.iter_ndjson(sessions), "application/x-ndjson", f"qknote-export-{stamp}.ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-cache"}
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+
 @app.get("/api/sessions/stream")
 async def stream_sessions(request: Request) -> StreamingResponse:
+    """Session list as a versioned stream: one snapshot, then only changed or deleted summaries.
+
+    Every event carries its change sequence as the SSE id, so a reconnecting EventSource
+    sends it back as Last-Event-ID and receives just the changes it missed.
+    """
+    last_event_id = request.headers.get("last-event-id") or request.query_params.get("last_event_id")
+
     async def event_generator():
-        last_payload = None
+        seq = int(last_event_id) if (last_event_id or "").isdigit() else None
+        current, floor = db.change_state()
+        if seq is None or seq < floor or seq > current:
+            seq, items = db.session_list_snapshot()
+            data = json.dumps({"seq": seq, "items": items}, ensure_ascii=False)
+            yield f"id: {seq}\nevent: sessions\ndata: {data}\n\n"
         while True:
             if await request.is_disconnected():
                 break
-            payload = {"items": db.list_sessions()}
-            data = json.dumps(payload, ensure_ascii=False)
-            if data != last_payload:
-                last_payload = data
-                yield f"event: sessions\ndata: {data}\n\n"
-            await asyncio.sleep(2)
+            latest, upserts, deleted = db.session_changes_since(seq)
+            if latest > seq:
+                seq = latest
+                data = json.dumps({"seq": seq, "upserts": upserts, "deleted": deleted}, ensure_ascii=False)
+                yield f"id: {seq}\nevent: delta\ndata: {data}\n\n"
+            await asyncio.sleep(1)
 
     headers = {"Cache-Control": "no-cache", "Connection": "keep-alive"}
     return StreamingResponse(event_generator(), media_type="text/event-stream", headers=headers)
 
 
 @app.get("/api/sessions/{session_id}")
+@profiling.profiled("get_session")
 def get_session(session_id: int) -> dict:
     session = db.get_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="not found")
     steps = db.list_session_steps(session_id)
-    return {"session": session, "steps": steps}
+    return {"session": session, "steps": steps, "notes": db.list_session_notes(session_id)}
+
+
+@app.get("/api/sessions/{session_id}/segments")
+@profiling.profiled("list_segments")
+def list_segments(session_id: int, start: float = 0, end: float | None = None, limit: int = 500) -> dict:
+    if not db.get_session_meta(session_id):
+        raise HTTPException(status_code=404, detail="not found")
+    items = db.list_segments(
+        session_id,
+        int(max(start, 0) * 1000),
+        int(end * 1000) if end is not None else None,
+        min(max(limit, 1), 2000),
+    )
+    return {"items": items}
+
+
+@app.get("/api/sessions/{session_id}/segments/at")
+@profiling.profiled("find_segment")
+def find_segment(session_id: int, t: float) -> dict:
+    if not db.get_session_meta(session_id):
+        raise HTTPException(status_code=404, detail="not found")
+    return {"segment": db.find_segment_at(session_id, int(max(t, 0) * 1000))}
+
+
+@app.post("/api/sessions/{session_id}/notes")
+def create_notes(session_id: int, payload: NoteIn) -> dict:
+    if not db.get_session_meta(session_id):
+        raise HTTPException(status_code=404, detail="not found")
+    if not db.get_transcript(session_id).strip():
+        raise HTTPException(status_code=409, detail="transcript not ready")
+    if not db.get_config():
+        raise HTTPException(status_code=400, detail="missing api key")
+
+    # Each style becomes its own job, so idle workers generate them in parallel.
+    styles = list(dict.fromkeys(payload.styles or [payload.style]))
+    ids = db.create_notes(session_id, styles, payload.remark, payload.include_joke)
+    worker.notify()
+    return {"ids": ids}
 
 
 @app.delete("/api/sessions/{session_id}")
 def delete_session(session_id: int) -> dict:
-    session = db.get_session(session_id)
+    session = db.get_session_meta(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="not found")
     _delete_audio_assets(session_id)
@@ -174,7 +322,7 @@ def delete_session(session_id: int) -> dict:
 
 
 def _delete_audio_assets(session_id: int) -> None:
-    audio_dir = Path(os.path.join(db.DATA_DIR, "audio"))
+    audio_dir = Path(db.AUDIO_DIR)
     if not audio_dir.exists():
         return
     for path in audio_dir.glob(f"{session_id}.*"):
@@ -191,12 +339,29 @@ def _delete_audio_assets(session_id: int) -> None:
 async def stream_session(session_id: int, request: Request) -> StreamingResponse:
     async def event_generator():
         last_payload = None
+        sent = 0
+        generation = None
         while True:
             if await request.is_disconnected():
                 break
-            session = db.get_session(session_id)
+            session = db.get_session_meta(session_id)
             steps = db.list_session_steps(session_id) if session else []
-            payload = {"session": session, "steps": steps}
+            notes = db.list_session_notes(session_id) if session else []
+            if session:
+                session["note"] = db.get_session_note(session_id)
+                # The transcript travels as `transcript` deltas tagged with its generation;
+                # a new generation (or offset 0) means the client replaces what it has.
+                tail = db.get_transcript_tail(session_id, sent)
+                reset = bool(tail and (tail[2] != generation or tail[0] < sent))
+                if reset:
+                    tail = db.get_transcript_tail(session_id, 0)
+                    sent = 0
+                if tail and (reset or tail[0] > sent):
+                    generation = tail[2]
+                    delta = json.dumps({"offset": sent, "delta": tail[1], "gen": generation}, ensure_ascii=False)
+                    sent = tail[0]
+                    yield f"event: transcript\ndata: {delta}\n\n"
+            payload = {"session": session, "steps": steps, "notes": notes}
             data = json.dumps(payload, ensure_ascii=False)
             if data != last_payload:
                 last_payload = data
@@ -1,101 +1,362 @@
+import hashlib
+import json
 import os
+import re
 import shutil
 import subprocess
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
-from yt_dlp import YoutubeDL
+import requests
 
-from . import db
+from . import db, downloads, profiling, subtitles
 from .qwen_client import QwenClient, is_no_valid_fragment_error
+from .video_id import canonical_video_key, fallback_key, key_from_info
 
-AUDIO_DIR = os.path.join(db.DATA_DIR, "audio")
+AUDIO_DIR = db.AUDIO_DIR
 REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 LOCAL_FFMPEG = os.path.join(REPO_ROOT, "tools", "ffmpeg", "bin", "ffmpeg.exe")
 SAFE_DATA_URI_BYTES = 7_000_000
 CHUNK_SECONDS = 120
 FALLBACK_AUDIO_MODEL = "qwen-audio-turbo-latest"
+USE_SUBTITLES = os.getenv("QKNOTE_USE_SUBTITLES", "1") != "0"
+TRIM_SILENCE = os.getenv("QKNOTE_TRIM_SILENCE", "1") != "0"
+SILENCE_NOISE_DB = float(os.getenv("QKNOTE_SILENCE_DB", "-35"))
+SILENCE_MIN_SECONDS = float(os.getenv("QKNOTE_SILENCE_MIN_SECONDS", "2"))
+SILENCE_PAD_SECONDS = 0.3
+TRIM_MIN_SAVED_SECONDS = 5.0
+# Long audio on filetrans models is cut into segments of this length and transcribed in parallel.
+FILETRANS_SEGMENT_SECONDS = float(os.getenv("QKNOTE_FILETRANS_SEGMENT_MINUTES", "25")) * 60
+FILETRANS_PARALLEL = int(os.getenv("QKNOTE_FILETRANS_PARALLEL", "4"))
+FILETRANS_RETRIES = int(os.getenv("QKNOTE_FILETRANS_RETRIES", "2"))
+SINGLE_FLIGHT = os.getenv("QKNOTE_SINGLE_FLIGHT", "1") != "0"
 
 
-def process_session(session_id: int, include_joke: bool) -> None:
+def process_session(session_id: int, include_joke: bool, lease_lost: threading.Event | None = None) -> None:
+    """Run the pipeline; ``lease_lost`` is set by the worker once another worker may own the session."""
+    lease_lost = lease_lost or threading.Event()
+    try:
+        _process_session(session_id, include_joke, lease_lost)
+    finally:
+        # After losing the lease the flights belong to the session's new run.
+        if SINGLE_FLIGHT and not lease_lost.is_set():
+            db.release_flights(session_id)
+
+
+class FlightBusy(Exception):
+    """Another live session is already doing this work; the session parks until it ends."""
+
+    def __init__(self, key: str, leader: int) -> None:
+        super().__init__(f"waiting for #{leader}")
+        self.key = key
+        self.leader = leader
+
+
+def _park(session_id: int, step: str, busy: FlightBusy, lease_lost: threading.Event) -> None:
+    """Give the worker back while the leader works; the session is claimed again when it is done."""
+    if _lease_lost(session_id, lease_lost):
+        return
+    db.park_session(session_id, busy.key)
+    db.update_step(session_id, step, "pending", f"waiting for #{busy.leader}")
+    print(f"[pipeline] session {session_id} parked behind #{busy.leader} ({busy.key[:48]})")
+
+
+def _finished_transcript(session_id: int) -> str | None:
+    steps = {step["step"]: step["status"] for step in db.list_session_steps(session_id)}
+    if steps.get("transcribe") != "completed":
+        return None
+    return db.get_transcript(session_id) or None
+
+
+def _lease_lost(session_id: int, lease_lost: threading.Event) -> bool:
+    if lease_lost.is_set():
+        print(f"[pipeline] session {session_id} lease lost; stopping without further writes")
+        return True
+    return False
+
+
+def _process_session(session_id: int, include_joke: bool, lease_lost: threading.Event) -> None:
     config = db.get_config()
     if not config:
         db.update_session(session_id, status="failed", stage="download", error="missing api key")
         db.update_step(session_id, "download", "failed", "missing api key")
         return
 
-    api_key = config["api_key"]
     audio_model = config["audio_model"]
     text_model = config["text_model"]
-    session = db.get_session(session_id)
+    session = db.get_session_meta(session_id)
     if not session:
         return
 
-    client = QwenClient(api_key)
+    # Requests are spread over the key pool, so chunks and segments can run on different keys.
+    client = QwenClient()
+    profile = profiling.wanted(bool(session.get("profile")))
+    profile_folder = profiling.session_folder(session_id)
 
+    # Set when an earlier run of this session stored the transcript, then parked at the note stage.
+    transcript = _finished_transcript(session_id)
     try:
-        db.update_session(session_id, status="running", stage="download")
-        db.update_step(session_id, "download", "running")
-        audio_path = download_audio(session_id, session["url"])
-        db.update_step(session_id, "download", "completed")
+        with profiling.stage(profile_folder, "download", profile):
+            db.update_session(session_id, status="running", stage="note" if transcript else "download")
+            if transcript is None:
+                db.update_step(session_id, "download", "running")
+                video_key, info = resolve_video_key(session["url"])
+                db.update_session(session_id, video_key=video_key)
+                transcript = reuse_transcript(session_id, video_key)
+                if transcript is None:
+                    transcript = follow_transcript(session_id, video_key)
+                if transcript is not None:
+                    db.update_step(session_id, "download", "completed", "skipped: transcript cached")
+                else:
+                    transcript = subtitle_transcript(session_id, session["url"], info)
+                if transcript is None:
+                    audio_path = download_audio(session_id, session["url"], video_key)
+                    db.update_step(session_id, "download", "completed")
+    except FlightBusy as busy:
+        _park(session_id, "download", busy, lease_lost)
+        return
     except Exception as exc:
         message = f"download failed: {exc}"
         db.update_session(session_id, status="failed", stage="download", error=message)
         db.update_step(session_id, "download", "failed", message)
         return
-
-    try:
-        db.update_session(session_id, stage="transcribe")
-        db.update_step(session_id, "transcribe", "running")
-        transcript_prompt = "Transcribe the audio to Simplified Chinese. Output plain text only."
-        transcript = transcribe_with_chunks(
-            client=client,
-            session_id=session_id,
-            audio_model=audio_model,
-            audio_path=audio_path,
-            prompt=transcript_prompt,
-        )
-        if not transcript.strip():
-            raise RuntimeError("empty transcript")
-        db.update_session(session_id, transcript=transcript)
-        db.update_step(session_id, "transcribe", "completed")
-    except Exception as exc:
-        message = f"transcribe failed: {exc}"
-        db.update_session(session_id, status="failed", stage="transcribe", error=message)
-        db.update_step(session_id, "transcribe", "failed", message)
+    if _lease_lost(session_id, lease_lost):
         return
 
+    if transcript is None:
+        try:
+            with profiling.stage(profile_folder, "transcribe", profile):
+                db.update_session(session_id, stage="transcribe")
+                db.update_step(session_id, "transcribe", "running")
+                offsets = None
+                trimmed = trim_silence(session_id, audio_path)
+                if trimmed:
+                    audio_path = trimmed["path"]
+                    offsets = trimmed["offsets"]
+                    db.update_session(
+                        session_id,
+                        audio_offsets=json.dumps(offsets),
+                        trimmed_seconds=trimmed["saved_seconds"],
+                        trimmed_bytes=trimmed["saved_bytes"],
+                    )
+                transcript_prompt = "Transcribe the audio to Simplified Chinese. Output plain text only."
+                transcript = transcribe_with_chunks(
+                    client=client,
+                    session_id=session_id,
+                    audio_model=audio_model,
+                    audio_path=audio_path,
+                    prompt=transcript_prompt,
+                    offsets=offsets,
+                )
+                if not transcript.strip():
+                    raise RuntimeError("empty transcript")
+                db.update_step(session_id, "transcribe", "completed", _trim_summary(trimmed))
+        except Exception as exc:
+            message = f"transcribe failed: {exc}"
+            db.update_session(session_id, status="failed", stage="transcribe", error=message)
+            db.update_step(session_id, "transcribe", "failed", message)
+            return
+        if _lease_lost(session_id, lease_lost):
+            return
+
     try:
-        db.update_session(session_id, stage="note")
-        db.update_step(session_id, "note", "running")
-        note_prompt = build_note_prompt(
-            transcript=transcript,
-            style=session.get("style"),
-            remark=session.get("remark"),
-            include_joke=include_joke,
-        )
-        note = client.generate_note(text_model, note_prompt)
-        db.update_session(session_id, note=note, status="completed")
-        db.update_step(session_id, "note", "completed")
+        with profiling.stage(profile_folder, "note", profile):
+            db.update_session(session_id, stage="note")
+            db.update_step(session_id, "note", "running")
+            note_prompt = build_note_prompt(
+                transcript=transcript,
+                style=session.get("style"),
+                remark=session.get("remark"),
+                include_joke=include_joke,
+            )
+            note_key = note_flight_key(note_prompt, text_model)
+            note = follow_note(session_id, note_key)
+            message = "reused identical note" if note is not None else None
+            if note is None:
+                note = client.generate_note(text_model, note_prompt)
+            if _lease_lost(session_id, lease_lost):
+                return
+            db.update_session(session_id, note=note, status="completed")
+            if SINGLE_FLIGHT and message is None:
+                db.finish_flight(note_key, session_id)
+            db.update_step(session_id, "note", "completed", message)
+    except FlightBusy as busy:
+        _park(session_id, "note", busy, lease_lost)
     except Exception as exc:
         message = f"note failed: {exc}"
         db.update_session(session_id, status="failed", stage="note", error=message)
         db.update_step(session_id, "note", "failed", message)
 
 
-def download_audio(session_id: int, url: str) -> str:
+def process_note(note: dict, lease_lost: threading.Event | None = None) -> None:
+    """Run only the note stage for a queued re-style job, against the session's stored transcript."""
+    note_id = int(note["id"])
+    config = db.get_config()
+    if not config:
+        db.update_note(note_id, status="failed", error="missing api key")
+        return
+    session = db.get_session(int(note["session_id"]))
+    transcript = (session or {}).get("transcript")
+    if not transcript or not transcript.strip():
+        db.update_note(note_id, status="failed", error="no transcript")
+        return
+
+    profile = profiling.wanted(bool(session.get("profile")))
+    try:
+        with profiling.stage(profiling.session_folder(session["id"]), f"note-{note_id}", profile):
+            db.update_note(note_id, status="running", error=None)
+            note_prompt = build_note_prompt(
+                transcript=transcript,
+                style=note.get("style"),
+                remark=note.get("remark"),
+                include_joke=bool(note.get("include_joke")),
+            )
+            text = QwenClient().generate_note(config["text_model"], note_prompt)
+            if lease_lost and lease_lost.is_set():
+                print(f"[pipeline] note {note_id} lease lost; dropping result")
+                return
+            db.update_note(note_id, note=text, status="completed")
+    except Exception as exc:
+        db.update_note(note_id, status="failed", error=f"note failed: {exc}")
+
+
+def follow_transcript(session_id: int, video_key: str) -> str | None:
+    """Return this video's transcript if another session just finished it, or None to do the work here.
+
+    Raises FlightBusy while another live session is downloading/transcribing the video.
+    """
+    if not SINGLE_FLIGHT:
+        return None
+    key = f"media:{video_key}"
+    leader = db.join_flight(key, session_id)["session_id"]
+    if leader != session_id:
+        raise FlightBusy(key, leader)
+    # Media flights are dropped when their session ends, so a leader that finished since
+    # the caller's own check looks like no leader at all: check for its transcript once more.
+    return reuse_transcript(session_id, video_key)
+
+
+def note_flight_key(note_prompt: str, text_model: str) -> str:
+    # The prompt already embeds the transcript, style, remark and joke setting.
+    digest = hashlib.sha256(f"{text_model}\n{note_prompt}".encode("utf-8")).hexdigest()
+    return f"note:{digest}"
+
+
+def follow_note(session_id: int, key: str) -> str | None:
+    """Return an identical note another session generated recently, or None to generate it here.
+
+    Raises FlightBusy while another live session is generating it.
+    """
+    if not SINGLE_FLIGHT:
+        return None
+    flight = db.join_flight(key, session_id)
+    leader = flight["session_id"]
+    if leader == session_id:
+        return None
+    if flight["status"] != "done":
+        raise FlightBusy(key, leader)
+    return db.get_session_note(leader)
+
+
+def resolve_video_key(url: str) -> tuple[str, dict | None]:
+    """Map a submitted URL to a platform video key, probing metadata only when offline rules fail.
+
+    Also returns the probe result when one was made, so later stages can reuse it.
+    """
+    key = canonical_video_key(url)
+    if key:
+        return key, None
+    url = url.strip()
+    probe = db.get_video_probe(url)
+    if probe:
+        return probe["video_key"], None
+    try:
+        info = probe_video(url)
+    except Exception as exc:
+        print(f"[resolve] metadata probe failed for {url}: {exc}")
+        return fallback_key(url), None
+    key = key_from_info(info) or fallback_key(url)
+    db.save_video_probe(url, key, info.get("title"))
+    return key, info
+
+
+def probe_video(url: str) -> dict:
+    from yt_dlp import YoutubeDL
+
+    ydl_opts = {
+        "quiet": True,
+        "no_warnings": True,
+        "noplaylist": True,
+        "skip_download": True,
+        # Subtitle tracks are only extracted when requested; nothing is written with download=False.
+        "writesubtitles": USE_SUBTITLES,
+        "writeautomaticsub": USE_SUBTITLES,
+        "subtitleslangs": ["all", "-danmaku", "-live_chat"],
+    }
+    with YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+    if not isinstance(info, dict):
+        raise RuntimeError("no metadata")
+    return info
+
+
+def subtitle_transcript(session_id: int, url: str, info: dict | None) -> str | None:
+    """Use platform subtitles (CC or AI) as the transcript when the video has them."""
+    if not USE_SUBTITLES:
+        return None
+    try:
+        info = info or probe_video(url)
+        track = subtitles.pick_track(info)
+        if not track:
+            return None
+        lang, entry = track
+        data = entry.get("data")
+        if not data:
+            response = requests.get(entry["url"], timeout=30)
+            response.raise_for_status()
+            data = response.text
+        cues = subtitles.parse_subtitle(data, entry.get("ext") or "")
+    except Exception as exc:
+        print(f"[subtitles] session {session_id} falling back to ASR: {exc}")
+        return None
+    text = subtitles.cues_to_text(cues)
+    if not text.strip():
+        return None
+    db.clear_transcript(session_id)
+    db.append_segments(session_id, [(int(start * 1000), int(end * 1000), cue) for start, end, cue in cues])
+    if info.get("title"):
+        db.update_session(session_id, title=info["title"])
+    db.update_step(session_id, "download", "completed", f"skipped: subtitles {lang}")
+    db.update_step(session_id, "transcribe", "completed", f"source: subtitles {lang}")
+    return text
+
+
+def reuse_transcript(session_id: int, video_key: str) -> str | None:
+    cached = db.find_latest_transcribed_session(video_key, exclude_session_id=session_id)
+    if not cached:
+        return None
+    db.copy_transcript(cached["id"], session_id)
+    if cached.get("title"):
+        db.update_session(session_id, title=cached["title"])
+    db.update_step(session_id, "transcribe", "completed", f"reused transcript from #{cached['id']}")
+    return cached["transcript"]
+
+
+def download_audio(session_id: int, url: str, video_key: str) -> str:
     os.makedirs(AUDIO_DIR, exist_ok=True)
-    cached = find_cached_audio(url)
+    cached = find_cached_audio(video_key, session_id)
     if cached:
-        cached_session_id, cached_path = cached
+        cached_session, cached_path = cached
         target_path = Path(AUDIO_DIR) / f"{session_id}{cached_path.suffix}"
         try:
             shutil.copy2(cached_path, target_path)
         except FileNotFoundError:
-            pass
+            db.mark_audio_evicted(cached_session["id"])
         else:
-            cached_session = db.get_session(cached_session_id)
-            if cached_session and cached_session.get("title"):
+            if cached_session.get("title"):
                 db.update_session(session_id, title=cached_session["title"])
+            db.set_session_audio(session_id, target_path.name)
             return str(target_path)
     output_template = os.path.join(AUDIO_DIR, f"{session_id}.%(ext)s")
 
@@ -118,8 +379,15 @@ def download_audio(session_id: int, url: str) -> str:
             }
         ],
     }
-    with YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=True)
+    from yt_dlp import YoutubeDL  # deferred: importing yt_dlp dominates backend startup
+
+    def waiting() -> None:
+        db.update_step(session_id, "download", "running", "waiting for a download slot")
+
+    with downloads.slot(url, on_wait=waiting) as extra_opts:
+        db.update_step(session_id, "download", "running")
+        with YoutubeDL({**ydl_opts, **extra_opts}) as ydl:
+            info = ydl.extract_info(url, download=True)
     if isinstance(info, dict):
         title = info.get("title")
         if title:
@@ -128,6 +396,7 @@ def download_audio(session_id: int, url: str) -> str:
     candidates = sorted(Path(AUDIO_DIR).glob(f"{session_id}.*"), key=os.path.getmtime, reverse=True)
     if not candidates:
         raise RuntimeError("audio file not found")
+    db.set_session_audio(session_id, candidates[0].name)
     return str(candidates[0])
 
 
@@ -140,14 +409,168 @@ def resolve_ffmpeg_location() -> str | None:
     return shutil.which("ffmpeg")
 
 
-def find_cached_audio(url: str) -> tuple[int, Path] | None:
-    cached_session_id = db.find_latest_downloaded_session(url)
-    if not cached_session_id:
+def find_cached_audio(video_key: str, session_id: int | None = None) -> tuple[dict, Path] | None:
+    while True:
+        cached = db.find_latest_downloaded_session(video_key, exclude_session_id=session_id)
+        if not cached:
+            return None
+        path = Path(AUDIO_DIR) / cached["audio_file"]
+        if path.exists():
+            db.touch_session_audio(cached["id"])
+            return cached, path
+        # File vanished outside the janitor; drop the stale pointer and try an older copy.
+        db.mark_audio_evicted(cached["id"])
+
+
+def trim_silence(session_id: int, audio_path: str) -> dict | None:
+    """Drop long silent stretches before ASR.
+
+    Returns the trimmed file with an offset map of ``[trimmed_start, source_start, length]``
+    entries (seconds), or None when trimming is disabled, fails or would save too little.
+    """
+    if not TRIM_SILENCE:
         return None
-    candidates = sorted(Path(AUDIO_DIR).glob(f"{cached_session_id}.*"), key=os.path.getmtime, reverse=True)
-    if not candidates:
+    ffmpeg_location = resolve_ffmpeg_location()
+    if not ffmpeg_location:
+        return None
+    try:
+        duration, silences = detect_silence(audio_path, ffmpeg_location)
+        offsets = _speech_offsets(duration, silences)
+        kept_seconds = sum(length for _, _, length in offsets)
+        saved_seconds = duration - kept_seconds
+        if not offsets or saved_seconds < TRIM_MIN_SAVED_SECONDS:
+            return None
+        work_dir = os.path.join(AUDIO_DIR, f"{session_id}_chunks")
+        os.makedirs(work_dir, exist_ok=True)
+        script_path = os.path.join(work_dir, "trim_filter.txt")
+        selects = "+".join(f"between(t,{start:.3f},{start + length:.3f})" for _, start, length in offsets)
+        with open(script_path, "w", encoding="ascii") as handle:
+            handle.write(f"aselect='{selects}',asetpts=N/SR/TB")
+        trimmed_path = os.path.join(work_dir, "trimmed.mp3")
+        cmd = [
+            ffmpeg_location,
+            "-y",
+            "-i",
+            audio_path,
+            "-filter_script:a",
+            script_path,
+            "-ac",
+            "1",
+            "-ar",
+            "16000",
+            "-b:a",
+            "64k",
+            trimmed_path,
+        ]
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except Exception as exc:
+        print(f"[trim] session {session_id} skipped: {exc}")
+        return None
+    # Bytes the dropped seconds would have taken in the same 16 kHz / 64 kbps encode, measured
+    # from the trimmed output; comparing with the source file would mostly count the re-encode.
+    saved_bytes = int(os.path.getsize(trimmed_path) * saved_seconds / kept_seconds)
+    print(f"[trim] session {session_id} dropped {saved_seconds:.1f}s, {saved_bytes} bytes")
+    return {
+        "path": trimmed_path,
+        "offsets": offsets,
+        "saved_seconds": round(saved_seconds, 3),
+        "saved_bytes": saved_bytes,
+    }
+
+
+def detect_silence(audio_path: str, ffmpeg_location: str) -> tuple[float, list[tuple[float, float]]]:
+    cmd = [
+        ffmpeg_location,
+        "-hide_banner",
+        "-nostats",
+        "-i",
+        audio_path,
+        "-af",
+        f"silencedetect=noise={SILENCE_NOISE_DB}dB:d={SILENCE_MIN_SECONDS}",
+        "-f",
+        "null",
+        "-",
+    ]
+    result = subprocess.run(cmd, check=True, capture_output=True, text=True, errors="replace")
+    return _parse_silencedetect(result.stderr)
+
+
+def _parse_silencedetect(output: str) -> tuple[float, list[tuple[float, float]]]:
+    duration = _parse_duration(output)
+    silences: list[tuple[float, float]] = []
+    start = None
+    for kind, value in re.findall(r"silence_(start|end): (-?\d+(?:\.\d+)?)", output):
+        if kind == "start":
+            start = max(float(value), 0.0)
+        elif start is not None:
+            silences.append((start, min(float(value), duration)))
+            start = None
+    if start is not None:
+        silences.append((start, duration))
+    return duration, silences
+
+
+def _parse_duration(output: str) -> float:
+    duration_match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", output)
+    if not duration_match:
+        raise RuntimeError("audio duration unknown")
+    hours, minutes, seconds = duration_match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def probe_duration(audio_path: str, ffmpeg_location: str) -> float:
+    # Without an output ffmpeg exits non-zero, but it has already printed the input's duration.
+    result = subprocess.run(
+        [ffmpeg_location, "-hide_banner", "-i", audio_path],
+        capture_output=True,
+        text=True,
+        errors="replace",
+    )
+    return _parse_duration(result.stderr)
+
+
+def _speech_offsets(duration: float, silences: list[tuple[float, float]]) -> list[list[float]]:
+    offsets: list[list[float]] = []
+    cursor = 0.0
+    trimmed_cursor = 0.0
+    for silence_start, silence_end in silences:
+        cut_start = silence_start + SILENCE_PAD_SECONDS if silence_start > 0 else 0.0
+        cut_end = silence_end - SILENCE_PAD_SECONDS if silence_end < duration else duration
+        if cut_end <= cut_start:
+            continue
+        if cut_start > cursor:
+            length = cut_start - cursor
+            offsets.append([round(trimmed_cursor, 3), round(cursor, 3), round(length, 3)])
+            trimmed_cursor += length
+        cursor = max(cursor, cut_end)
+    if duration > cursor:
+        offsets.append([round(trimmed_cursor, 3), round(cursor, 3), round(duration - cursor, 3)])
+    return offsets
+
+
+def source_time(offsets: list[list[float]] | None, trimmed_seconds: float) -> float:
+    """Map a position in the trimmed audio back to the original media time."""
+    if not offsets:
+        return trimmed_seconds
+    entry = offsets[0]
+    for candidate in offsets:
+        if candidate[0] > trimmed_seconds:
+            break
+        entry = candidate
+    trimmed_start, source_start, length = entry
+    return source_start + min(max(trimmed_seconds - trimmed_start, 0.0), length)
+
+
+def _trim_summary(trimmed: dict | None) -> str | None:
+    if not trimmed:
         return None
-    return cached_session_id, candidates[0]
+    return f"trimmed {trimmed['saved_seconds']:.0f}s silence, {trimmed['saved_bytes'] / 1_000_000:.1f} MB"
+
+
+def _format_clock(seconds: float) -> str:
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes:02d}:{secs:02d}"
 
 
 def transcribe_with_chunks(
@@ -156,14 +579,15 @@ def transcribe_with_chunks(
     audio_model: str,
     audio_path: str,
     prompt: str,
+    offsets: list[list[float]] | None = None,
 ) -> str:
     try:
-        return _transcribe_with_model(client, session_id, audio_model, audio_path, prompt)
+        return _transcribe_with_model(client, session_id, audio_model, audio_path, prompt, offsets)
     except Exception as exc:
         if client.is_filetrans_model(audio_model) and is_no_valid_fragment_error(exc):
             print(f"[transcribe] filetrans no valid fragment; fallback to {FALLBACK_AUDIO_MODEL}")
             db.update_step(session_id, "transcribe", "running", f"fallback {FALLBACK_AUDIO_MODEL}")
-            return _transcribe_with_model(client, session_id, FALLBACK_AUDIO_MODEL, audio_path, prompt)
+            return _transcribe_with_model(client, session_id, FALLBACK_AUDIO_MODEL, audio_path, prompt, offsets)
         print(f"[transcribe] failed: {exc}")
         raise
 
@@ -174,29 +598,152 @@ def _transcribe_with_model(
     audio_model: str,
     audio_path: str,
     prompt: str,
+    offsets: list[list[float]] | None = None,
 ) -> str:
+    """Transcribe into ``transcript_segments``, storing each chunk or sentence batch as soon as it is known.
+
+    Segment times are mapped back to the original media through ``offsets``.
+    """
+    db.clear_transcript(session_id)
     if client.is_filetrans_model(audio_model):
-        return client.transcribe_audio(audio_model, audio_path, prompt)
+        ffmpeg_location = resolve_ffmpeg_location()
+        if ffmpeg_location and probe_duration(audio_path, ffmpeg_location) > FILETRANS_SEGMENT_SECONDS * 1.5:
+            return _transcribe_filetrans_segments(client, session_id, audio_model, audio_path, prompt, offsets, ffmpeg_location)
+        writer = _SegmentWriter(session_id, offsets)
+        client.transcribe_audio(audio_model, audio_path, prompt, on_segment=writer.add)
+        writer.flush()
+        return _stored_transcript(session_id)
     if os.path.getsize(audio_path) <= SAFE_DATA_URI_BYTES:
-        return client.transcribe_audio(audio_model, audio_path, prompt)
+        text = client.transcribe_audio(audio_model, audio_path, prompt).strip()
+        db.append_segments(session_id, [(0, 0, text)])
+        return _stored_transcript(session_id)
 
     ffmpeg_location = resolve_ffmpeg_location()
     if not ffmpeg_location:
         raise RuntimeError("ffmpeg not found. Run scripts/setup.ps1 first.")
 
     chunks = split_audio(audio_path, session_id, ffmpeg_location)
-    transcripts: list[str] = []
     total = len(chunks)
     for index, chunk_path in enumerate(chunks, start=1):
-        db.update_step(session_id, "transcribe", "running", f"chunk {index}/{total}")
-        transcripts.append(client.transcribe_audio(audio_model, chunk_path, prompt))
-    return "\n".join([part.strip() for part in transcripts if part.strip()])
+        position = _format_clock(source_time(offsets, (index - 1) * CHUNK_SECONDS))
+        db.update_step(session_id, "transcribe", "running", f"chunk {index}/{total} @ {position}")
+        part = client.transcribe_audio(audio_model, chunk_path, prompt).strip()
+        start = _to_ms(source_time(offsets, (index - 1) * CHUNK_SECONDS))
+        end = _to_ms(source_time(offsets, index * CHUNK_SECONDS))
+        db.append_segments(session_id, [(start, end, part)])
+    return _stored_transcript(session_id)
+
+
+def _transcribe_filetrans_segments(
+    client: QwenClient,
+    session_id: int,
+    audio_model: str,
+    audio_path: str,
+    prompt: str,
+    offsets: list[list[float]] | None,
+    ffmpeg_location: str,
+) -> str:
+    """Transcribe long audio as parallel filetrans tasks over large segments, stitched in order.
+
+    A failed segment is retried on its own. A segment without speech (no valid fragment)
+    contributes nothing; only when every segment is like that does the error propagate,
+    so the caller can fall back to another model.
+    """
+    parts = split_audio(audio_path, session_id, ffmpeg_location, FILETRANS_SEGMENT_SECONDS, "part")
+    total = len(parts)
+    results: dict[int, list[tuple[int, int, str]]] = {}
+    attempts = dict.fromkeys(range(total), 0)
+    silent: list[Exception] = []
+    stored = 0
+
+    def run(index: int) -> list[tuple[int, int, str]]:
+        base = index * FILETRANS_SEGMENT_SECONDS
+        collected: list[tuple[int, int, str]] = []
 
+        def add(start_ms: int, end_ms: int, text: str) -> None:
+            start = _to_ms(source_time(offsets, base + start_ms / 1000))
+            end = _to_ms(source_time(offsets, base + end_ms / 1000))
+            collected.append((start, end, text))
 
-def split_audio(audio_path: str, session_id: int, ffmpeg_location: str) -> list[str]:
+        try:
+            client.transcribe_audio(audio_model, parts[index], prompt, on_segment=add)
+        except Exception as exc:
+            if not is_no_valid_fragment_error(exc):
+                raise
+            silent.append(exc)
+            return []
+        return collected
+
+    db.update_step(session_id, "transcribe", "running", f"segments 0/{total}")
+    with ThreadPoolExecutor(max_workers=max(FILETRANS_PARALLEL, 1), thread_name_prefix="filetrans") as executor:
+        pending = {executor.submit(run, index): index for index in range(total)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                attempts[index] += 1
+                try:
+                    results[index] = future.result()
+                except Exception as exc:
+                    if attempts[index] > FILETRANS_RETRIES:
+                        for other in pending:
+                            other.cancel()
+                        raise RuntimeError(f"segment {index + 1}/{total} failed: {exc}") from exc
+                    print(f"[transcribe] session {session_id} segment {index + 1}/{total} failed, retrying: {exc}")
+                    pending[executor.submit(run, index)] = index
+            # Store finished segments in order so the transcript grows front to back.
+            while stored in results:
+                db.append_segments(session_id, results.pop(stored))
+                stored += 1
+            db.update_step(session_id, "transcribe", "running", f"segments {stored}/{total}")
+    if len(silent) == total:
+        raise silent[0]
+    return _stored_transcript(session_id)
+
+
+class _SegmentWriter:
+    """Buffers streamed sentences and stores them in batches, in original-media time."""
+
+    BATCH_SIZE = 200
+
+    def __init__(self, session_id: int, offsets: list[list[float]] | None) -> None:
+        self.session_id = session_id
+        self.offsets = offsets
+        self.pending: list[tuple[int, int, str]] = []
+
+    def add(self, start_ms: int, end_ms: int, text: str) -> None:
+        start = _to_ms(source_time(self.offsets, start_ms / 1000))
+        end = _to_ms(source_time(self.offsets, end_ms / 1000))
+        self.pending.append((start, end, text))
+        if len(self.pending) >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.pending:
+            db.append_segments(self.session_id, self.pending)
+            self.pending = []
+
+
+def _to_ms(seconds: float) -> int:
+    return int(round(seconds * 1000))
+
+
+def _stored_transcript(session_id: int) -> str:
+    return db.get_transcript(session_id)
+
+
+def split_audio(
+    audio_path: str,
+    session_id: int,
+    ffmpeg_location: str,
+    segment_seconds: float = CHUNK_SECONDS,
+    prefix: str = "chunk",
+) -> list[str]:
     chunk_dir = os.path.join(AUDIO_DIR, f"{session_id}_chunks")
     os.makedirs(chunk_dir, exist_ok=True)
-    output_template = os.path.join(chunk_dir, "chunk_%03d.mp3")
+    for stale in Path(chunk_dir).glob(f"{prefix}_*.mp3"):
+        stale.unlink()
+    output_template = os.path.join(chunk_dir, f"{prefix}_%03d.mp3")
     cmd = [
         ffmpeg_location,
         "-y",
@@ -211,13 +758,13 @@ def split_audio(audio_path: str, session_id: int, ffmpeg_location: str) -> list[
         "-f",
         "segment",
         "-segment_time",
-        str(CHUNK_SECONDS),
+        str(segment_seconds),
         "-reset_timestamps",
         "1",
         output_template,
     ]
     subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    chunks = sorted(Path(chunk_dir).glob("chunk_*.mp3"))
+    chunks = sorted(Path(chunk_dir).glob(f"{prefix}_*.mp3"))
     if not chunks:
         raise RuntimeError("audio split failed")
     return [str(path) for path in chunks]
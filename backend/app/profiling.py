@@ -0,0 +1,176 @@
+import contextlib
+import contextvars
+import cProfile
+import functools
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from collections.abc import Callable, Iterator
+from datetime import datetime
+
+from . import db
+
+ENABLED = os.getenv("QKNOTE_PROFILE", "0") == "1"
+PROFILE_DIR = os.path.abspath(os.getenv("QKNOTE_PROFILE_DIR") or os.path.join(db.DATA_DIR, "profiles"))
+HEADER = "X-QkNote-Profile"
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 20
+
+# Set per request by the middleware when the profiling header is present.
+request_profiling: contextvars.ContextVar[bool] = contextvars.ContextVar("request_profiling", default=False)
+
+_trace_lock = threading.Lock()
+# Python 3.12+ allows one active cProfile per process; overlapping stages skip it.
+_cprofile_lock = threading.Lock()
+_trace_users = 0
+_trace_owned = False
+_SAFE_NAME_RE = re.compile(r"[^\w.-]+")
+
+
+def wanted(flag: bool = False) -> bool:
+    return ENABLED or flag or request_profiling.get()
+
+
+@contextlib.contextmanager
+def stage(folder: str, name: str, enabled: bool) -> Iterator[None]:
+    """Profile the enclosed block with cProfile and tracemalloc and save a report under ``folder``.
+
+    cProfile only sees the calling thread, and only one stage at a time gets it: a stage
+    overlapping another (or an external profiler) records wall time and memory only.
+    tracemalloc is process-wide, so the peak it reports includes anything else allocating
+    at the same time (e.g. other workers). Profiling never fails the profiled block.
+    """
+    if not enabled:
+        yield
+        return
+    _start_tracing()
+    profiler = None
+    started = time.perf_counter()
+    try:
+        tracemalloc.reset_peak()
+        profiler = _start_cprofile()
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _cprofile_lock.release()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        _stop_tracing()
+        try:
+            _save(folder, name, profiler, elapsed, peak, snapshot)
+        except Exception as exc:
+            print(f"[profiling] failed to save {folder}/{name}: {exc}")
+
+
+def session_folder(session_id: int) -> str:
+    return f"session-{session_id}"
+
+
+def profiled(name: str) -> Callable:
+    """Profile a sync endpoint when the mode is on or the request carries the profiling header."""
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not wanted():
+                return func(*args, **kwargs)
+            folder = os.path.join("requests", datetime.utcnow().strftime("%Y%m%d"))
+            label = f"{datetime.utcnow().strftime('%H%M%S%f')}-{name}"
+            with stage(folder, label, True):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def list_profiles() -> list[dict]:
+    items = []
+    if not os.path.isdir(PROFILE_DIR):
+        return items
+    for root, _, files in os.walk(PROFILE_DIR):
+        for filename in files:
+            path = os.path.join(root, filename)
+            stat = os.stat(path)
+            items.append(
+                {
+                    "path": os.path.relpath(path, PROFILE_DIR).replace(os.sep, "/"),
+                    "bytes": stat.st_size,
+                    "modified_at": datetime.utcfromtimestamp(stat.st_mtime).isoformat(timespec="seconds"),
+                }
+            )
+    items.sort(key=lambda item: item["modified_at"], reverse=True)
+    return items
+
+
+def resolve_profile(relative: str) -> str | None:
+    """Absolute path of a saved profile file, or None if it does not exist or escapes PROFILE_DIR."""
+    path = os.path.abspath(os.path.join(PROFILE_DIR, relative))
+    if os.path.commonpath([path, PROFILE_DIR]) != PROFILE_DIR or not os.path.isfile(path):
+        return None
+    return path
+
+
+def _start_cprofile() -> cProfile.Profile | None:
+    if not _cprofile_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # another profiling tool is active in this process
+        _cprofile_lock.release()
+        return None
+    return profiler
+
+
+def _start_tracing() -> None:
+    global _trace_users, _trace_owned
+    with _trace_lock:
+        if _trace_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _trace_owned = True
+        _trace_users += 1
+
+
+def _stop_tracing() -> None:
+    global _trace_users, _trace_owned
+    with _trace_lock:
+        _trace_users -= 1
+        if _trace_users == 0 and _trace_owned:
+            tracemalloc.stop()
+            _trace_owned = False
+
+
+def _save(
+    folder: str,
+    name: str,
+    profiler: cProfile.Profile | None,
+    elapsed: float,
+    peak: int,
+    snapshot: tracemalloc.Snapshot,
+) -> None:
+    target = os.path.join(PROFILE_DIR, folder)
+    os.makedirs(target, exist_ok=True)
+    base = os.path.join(target, _SAFE_NAME_RE.sub("-", name))
+    if profiler is not None:
+        profiler.dump_stats(f"{base}.prof")
+
+    report = io.StringIO()
+    report.write(f"{name}: {elapsed:.3f}s wall, tracemalloc peak {peak / 1_000_000:.1f} MB\n\n")
+    report.write("Top allocation sites still live at the end of the stage:\n")
+    for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+        report.write(f"  {stat}\n")
+    report.write("\n")
+    if profiler is None:
+        report.write("cProfile skipped: another stage or profiler was active.\n")
+    else:
+        stats = pstats.Stats(profiler, stream=report)
+        stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+    with open(f"{base}.txt", "w", encoding="utf-8") as handle:
+        handle.write(report.getvalue())
@@ -1,42 +1,84 @@
 import base64
+import hashlib
 import io
 import os
 import re
 import tempfile
+import threading
+import time
 import wave
-from typing import Any
-
-import dashscope
-try:  # dashscope>=1.15 uses File, older versions expose Files
-    from dashscope import Files as DashscopeFile
-except ImportError:  # pragma: no cover - depends on installed dashscope
-    from dashscope import File as DashscopeFile
-try:  # dashscope newer versions use audio.asr.transcription.Transcription
-    from dashscope.audio.qwen_asr import QwenTranscription as DashscopeTranscription
-except ImportError:  # pragma: no cover - depends on installed dashscope
-    from dashscope.audio.asr.transcription import Transcription as DashscopeTranscription
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterator, TypeVar
+from urllib.parse import parse_qs, urlparse
+
 import requests
 
+try:
+    import ijson
+except ImportError:  # optional: without it the result JSON is loaded whole
+    ijson = None
+
+from . import db, key_pool
+
 DEFAULT_BASE_URL = "https://dashscope.aliyuncs.com/api/v1"
 TEXT_ENDPOINT = "services/aigc/text-generation/generation"
 MULTIMODAL_ENDPOINT = "services/aigc/multimodal-generation/generation"
+UPLOAD_TTL_SECONDS = float(os.getenv("DASHSCOPE_UPLOAD_TTL", "3600"))
+UPLOAD_URL_MARGIN_SECONDS = 300
+# A task keeps the upload it uses from being swept for at most this long (covers crashed processes).
+UPLOAD_HOLD_SECONDS = 2 * 3600
+# Hedging: re-send a slow audio request once it outlives the model's rolling p95 latency.
+HEDGE_ENABLED = os.getenv("QWEN_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("QWEN_HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("QWEN_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("QWEN_HEDGE_MIN_DELAY", "2"))
+# Hedges may add at most this fraction on top of primary requests.
+HEDGE_BUDGET = float(os.getenv("QWEN_HEDGE_BUDGET", "0.05"))
+LATENCY_WINDOW = 200
+
+# Uploaded files live in the uploads table keyed by (api_key, sha256 of content) and are
+# reused until they expire, across processes and restarts.
+_digests: dict[tuple[str, int, int], str] = {}
+_uploads_lock = threading.Lock()
+_upload_stats = {"uploads": 0, "reused": 0, "bytes_uploaded": 0, "bytes_saved": 0, "deleted": 0}
+
+_latencies: dict[str, deque[float]] = {}
+_hedge_lock = threading.Lock()
+_hedge_stats = {"requests": 0, "hedges": 0, "hedge_wins": 0, "budget_denied": 0}
+_hedge_executor: ThreadPoolExecutor | None = None
+
+# Called with (start_ms, end_ms, text) for each recognized sentence, in order.
+SegmentCallback = Callable[[int, int, str], None]
+_SENTENCE_PREFIX = "transcripts.item.sentences.item"
+
+T = TypeVar("T")
 
 
 class QwenClient:
-    def __init__(self, api_key: str, base_url: str | None = None) -> None:
+    def __init__(self, api_key: str | None = None, base_url: str | None = None) -> None:
+        # Without an explicit key every request borrows one from the stored key pool.
         self.api_key = api_key
         self.base_url = (base_url or os.getenv("DASHSCOPE_BASE_URL") or DEFAULT_BASE_URL).rstrip("/")
-        dashscope.base_http_api_url = self.base_url
 
-    def _headers(self) -> dict[str, str]:
+    def _with_key(self, func: Callable[[str], T]) -> T:
+        if self.api_key:
+            return func(self.api_key)
+        return key_pool.call(func)
+
+    @staticmethod
+    def _headers(api_key: str) -> dict[str, str]:
         return {
-            "Authorization": f"Bearer {self.api_key}",
+            "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
         }
 
     def _post(self, path: str, payload: dict[str, Any]) -> dict[str, Any]:
+        return self._with_key(lambda api_key: self._post_with_key(path, payload, api_key))
+
+    def _post_with_key(self, path: str, payload: dict[str, Any], api_key: str) -> dict[str, Any]:
         url = f"{self.base_url}/{path}"
-        response = requests.post(url, headers=self._headers(), json=payload, timeout=120)
+        response = requests.post(url, headers=self._headers(api_key), json=payload, timeout=120)
         if response.status_code != 200:
             try:
                 detail = response.json()
@@ -108,9 +150,11 @@ class QwenClient:
         }
         self._post(MULTIMODAL_ENDPOINT, payload)
 
-    def transcribe_audio(self, model: str, audio_path: str, prompt: str) -> str:
+    def transcribe_audio(
+        self, model: str, audio_path: str, prompt: str, on_segment: SegmentCallback | None = None
+    ) -> str:
         if _is_filetrans_model(model):
-            return self._transcribe_filetrans(model, audio_path)
+            return self._transcribe_filetrans(model, audio_path, on_segment)
 
         data_url, fmt = _audio_to_data_url(audio_path)
         payload = {
@@ -131,9 +175,47 @@ class QwenClient:
             },
             "parameters": {"result_format": "message"},
         }
-        data = self._post(MULTIMODAL_ENDPOINT, payload)
+        data = self._post_hedged(MULTIMODAL_ENDPOINT, payload, model)
         return self._extract_message_text(data)
 
+    def _post_timed(self, path: str, payload: dict[str, Any], model: str) -> dict[str, Any]:
+        start = time.monotonic()
+        data = self._post(path, payload)
+        _record_latency(model, time.monotonic() - start)
+        return data
+
+    def _post_hedged(self, path: str, payload: dict[str, Any], model: str) -> dict[str, Any]:
+        """POST, sending one duplicate if the first answer is slower than the model's usual tail.
+
+        Whichever copy succeeds first wins; the other is left to finish in the background
+        (its latency still feeds the percentile window).
+        """
+        with _hedge_lock:
+            _hedge_stats["requests"] += 1
+        delay = _hedge_delay(model) if HEDGE_ENABLED else None
+        if delay is None:
+            return self._post_timed(path, payload, model)
+        executor = _executor()
+        primary = executor.submit(self._post_timed, path, payload, model)
+        done, _ = wait([primary], timeout=delay)
+        if done or not _take_hedge_budget():
+            return primary.result()
+        print(f"[hedge] {model} request exceeded {delay:.2f}s; sending duplicate")
+        hedge = executor.submit(self._post_timed, path, payload, model)
+        pending = {primary, hedge}
+        error: BaseException | None = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                if future is hedge:
+                    with _hedge_lock:
+                        _hedge_stats["hedge_wins"] += 1
+                return future.result()
+        raise error
+
     def generate_note(self, model: str, prompt: str) -> str:
         payload = {
             "model": model,
@@ -151,14 +233,74 @@ class QwenClient:
     def is_filetrans_model(model: str) -> bool:
         return _is_filetrans_model(model)
 
-    def _transcribe_filetrans(self, model: str, audio_path: str) -> str:
-        upload = DashscopeFile.upload(file_path=audio_path, purpose="assistants", api_key=self.api_key)
+    def _transcribe_filetrans(self, model: str, audio_path: str, on_segment: SegmentCallback | None = None) -> str:
+        # Uploads belong to the key that made them, so one key serves the whole task.
+        return self._with_key(
+            lambda api_key: self._transcribe_filetrans_with_key(model, audio_path, on_segment, api_key)
+        )
+
+    def _transcribe_filetrans_with_key(
+        self, model: str, audio_path: str, on_segment: SegmentCallback | None, api_key: str
+    ) -> str:
+        _dashscope().base_http_api_url = self.base_url
+        file_id, file_url = self._upload_file(audio_path, api_key)
+        forget = False
+        try:
+            response = _call_transcription(model=model, file_url=file_url, api_key=api_key)
+            output = response.get("output") or {}
+            if output.get("task_status") != "SUCCEEDED":
+                raise RuntimeError(f"filetrans failed: {output}")
+        except Exception as exc:
+            # The file or its URL may be unusable; make the next attempt upload afresh.
+            forget = not is_no_valid_fragment_error(exc)
+            raise
+        finally:
+            db.release_upload(file_id, forget)
+        result = output.get("result") or {}
+        transcription_url = result.get("transcription_url")
+        texts = []
+        if transcription_url:
+            segments = _stream_filetrans_segments(transcription_url)
+        else:
+            segments = _filetrans_segments(output)
+        for start_ms, end_ms, segment_text in segments:
+            texts.append(segment_text)
+            if on_segment:
+                on_segment(start_ms, end_ms, segment_text)
+        if not texts and not transcription_url:
+            fallback = _extract_text_recursive(output)
+            if fallback:
+                texts.append(fallback)
+                if on_segment:
+                    on_segment(0, 0, fallback)
+        text = "\n".join(texts).strip()
+        if not text:
+            raise RuntimeError("empty transcript")
+        return text
+
+    def _upload_file(self, audio_path: str, api_key: str) -> tuple[str, str]:
+        """Upload a file for filetrans, reusing a still-valid upload of identical content.
+
+        The upload stays pinned against sweeping until the caller releases it.
+        """
+        digest = _file_digest(audio_path)
+        size = os.path.getsize(audio_path)
+        now = time.time()
+        entry = db.acquire_upload(api_key, digest, now, UPLOAD_HOLD_SECONDS)
+        if entry:
+            with _uploads_lock:
+                _upload_stats["reused"] += 1
+                _upload_stats["bytes_saved"] += size
+            return entry["file_id"], entry["file_url"]
+
+        DashscopeFile = _file_api()
+        upload = DashscopeFile.upload(file_path=audio_path, purpose="assistants", api_key=api_key)
         upload_output = upload.get("output") or {}
         file_id = _extract_file_id(upload_output)
         if not file_id:
             raise RuntimeError(f"file upload missing file_id: {upload_output}")
         try:
-            info = DashscopeFile.get(file_id, api_key=self.api_key)
+            info = DashscopeFile.get(file_id, api_key=api_key)
             info_output = info.get("output") or {}
             file_url = (
                 _extract_file_url(upload_output)
@@ -168,25 +310,142 @@ class QwenClient:
             )
             if not file_url:
                 raise RuntimeError(f"missing file url for file_id {file_id}")
-            response = _call_transcription(model=model, file_url=file_url, api_key=self.api_key)
-            output = response.get("output") or {}
-            if output.get("task_status") != "SUCCEEDED":
-                raise RuntimeError(f"filetrans failed: {output}")
-            result = output.get("result") or {}
-            transcription_url = result.get("transcription_url")
-            if transcription_url:
-                transcription = requests.get(transcription_url, timeout=120).json()
-                text = _extract_filetrans_text(transcription)
-            else:
-                text = _extract_filetrans_text(output)
-            if not text:
-                raise RuntimeError("empty transcript")
-            return text
-        finally:
-            try:
-                DashscopeFile.delete(file_id, api_key=self.api_key)
-            except Exception:
-                pass
+        except Exception:
+            # Registered as already expired so the next sweep deletes it.
+            db.add_upload(api_key, digest, file_id, None, 0.0, 0.0)
+            raise
+        db.add_upload(api_key, digest, file_id, file_url, _upload_expiry(file_url, now), now + UPLOAD_HOLD_SECONDS)
+        with _uploads_lock:
+            _upload_stats["uploads"] += 1
+            _upload_stats["bytes_uploaded"] += size
+        return file_id, file_url
+
+
+def sweep_uploads() -> int:
+    """Delete uploads that expired or were invalidated and that no task is using.
+
+    Safe to call from any thread or process: each row is claimed by exactly one sweeper.
+    """
+    doomed = db.claim_expired_uploads(time.time())
+    if not doomed:
+        return 0
+    DashscopeFile = _file_api()
+    for entry in doomed:
+        try:
+            DashscopeFile.delete(entry["file_id"], api_key=entry["api_key"])
+        except Exception as exc:
+            print(f"[uploads] delete {entry['file_id']} failed: {exc}")
+    with _uploads_lock:
+        _upload_stats["deleted"] += len(doomed)
+    return len(doomed)
+
+
+def upload_stats() -> dict[str, Any]:
+    active = db.count_uploads(time.time())
+    with _uploads_lock:
+        return {**_upload_stats, "active": active}
+
+
+def hedge_stats() -> dict[str, Any]:
+    with _hedge_lock:
+        latency = {
+            model: {
+                "samples": len(samples),
+                "p50": _percentile(samples, 0.5),
+                "p95": _percentile(samples, HEDGE_PERCENTILE),
+            }
+            for model, samples in _latencies.items()
+        }
+        return {**_hedge_stats, "enabled": HEDGE_ENABLED, "latency": latency}
+
+
+def _record_latency(model: str, seconds: float) -> None:
+    with _hedge_lock:
+        _latencies.setdefault(model, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+
+def _percentile(samples: deque[float], fraction: float) -> float | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(int(fraction * len(ordered)), len(ordered) - 1)], 3)
+
+
+def _hedge_delay(model: str) -> float | None:
+    """Seconds to wait before hedging, or None while the model has too few samples."""
+    with _hedge_lock:
+        samples = _latencies.get(model)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(_percentile(samples, HEDGE_PERCENTILE), HEDGE_MIN_DELAY_SECONDS)
+
+
+def _take_hedge_budget() -> bool:
+    with _hedge_lock:
+        if _hedge_stats["hedges"] + 1 > HEDGE_BUDGET * _hedge_stats["requests"]:
+            _hedge_stats["budget_denied"] += 1
+            return False
+        _hedge_stats["hedges"] += 1
+        return True
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    with _hedge_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="qwen-hedge")
+        return _hedge_executor
+
+
+def _upload_expiry(file_url: str, now: float) -> float:
+    expiry = now + UPLOAD_TTL_SECONDS
+    # Signed OSS URLs carry their own deadline; never hand out a URL about to lapse.
+    signed = (parse_qs(urlparse(file_url).query).get("Expires") or [None])[0]
+    if signed and signed.isdigit():
+        expiry = min(expiry, int(signed) - UPLOAD_URL_MARGIN_SECONDS)
+    return expiry
+
+
+def _file_digest(path: str) -> str:
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _uploads_lock:
+        cached = _digests.get(key)
+    if cached:
+        return cached
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(block)
+    digest = hasher.hexdigest()
+    with _uploads_lock:
+        if len(_digests) > 256:
+            _digests.clear()
+        _digests[key] = digest
+    return digest
+
+
+def _dashscope():
+    # dashscope and its ASR submodules are slow to import; load them on first filetrans use.
+    import dashscope
+
+    return dashscope
+
+
+def _file_api():
+    try:  # dashscope>=1.15 uses File, older versions expose Files
+        from dashscope import Files as DashscopeFile
+    except ImportError:  # pragma: no cover - depends on installed dashscope
+        from dashscope import File as DashscopeFile
+    return DashscopeFile
+
+
+def _transcription_api():
+    try:  # dashscope newer versions use audio.asr.transcription.Transcription
+        from dashscope.audio.qwen_asr import QwenTranscription as DashscopeTranscription
+    except ImportError:  # pragma: no cover - depends on installed dashscope
+        from dashscope.audio.asr.transcription import Transcription as DashscopeTranscription
+    return DashscopeTranscription
 
 
 def _audio_to_data_url(audio_path: str) -> tuple[str, str]:
@@ -235,6 +494,7 @@ def is_no_valid_fragment_error(exc: Exception) -> bool:
 
 
 def _call_transcription(model: str, file_url: str, api_key: str):
+    DashscopeTranscription = _transcription_api()
     try:
         return DashscopeTranscription.call(model=model, file_url=file_url, api_key=api_key)
     except TypeError:
@@ -299,19 +559,73 @@ def _extract_text_recursive(node: Any, key_hint: str | None = None) -> str:
     return ""
 
 
-def _extract_filetrans_text(data: Any) -> str:
-    if isinstance(data, dict):
-        transcripts = data.get("transcripts")
-        if isinstance(transcripts, list):
-            texts = []
-            for item in transcripts:
-                if isinstance(item, dict):
-                    value = item.get("text")
-                    if isinstance(value, str) and value.strip():
-                        texts.append(value.strip())
-            if texts:
-                return "\n".join(texts).strip()
-    return _extract_text_recursive(data)
+def _stream_filetrans_segments(url: str) -> Iterator[tuple[int, int, str]]:
+    """Yield sentence segments from a filetrans result URL without loading the document.
+
+    With ijson the response is parsed incrementally and only one sentence (minus its
+    per-word timings) is materialized at a time; otherwise the JSON is loaded whole.
+    """
+    with requests.get(url, stream=True, timeout=120) as response:
+        response.raise_for_status()
+        if ijson is None:
+            yield from _filetrans_segments(response.json())
+            return
+        response.raw.decode_content = True
+        channel_texts: list[str] = []
+        sentences = 0
+        builder = None
+        words_prefix = f"{_SENTENCE_PREFIX}.words"
+        for prefix, event, value in ijson.parse(response.raw):
+            if builder is not None:
+                if prefix == _SENTENCE_PREFIX and event == "end_map":
+                    builder.event(event, value)
+                    segment = _sentence_segment(builder.value)
+                    builder = None
+                    if segment:
+                        sentences += 1
+                        yield segment
+                elif prefix == words_prefix or prefix.startswith(f"{words_prefix}.") or (
+                    prefix == _SENTENCE_PREFIX and event == "map_key" and value == "words"
+                ):
+                    continue  # per-word timings are not stored
+                else:
+                    builder.event(event, value)
+            elif prefix == _SENTENCE_PREFIX and event == "start_map":
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+            elif prefix == "transcripts.item.text" and event == "string" and value.strip():
+                channel_texts.append(value.strip())
+        if not sentences:
+            for text in channel_texts:
+                yield 0, 0, text
+
+
+def _filetrans_segments(data: Any) -> Iterator[tuple[int, int, str]]:
+    """Structural walk of an in-memory filetrans result: transcripts[].sentences[], else transcripts[].text."""
+    transcripts = data.get("transcripts") if isinstance(data, dict) else None
+    if not isinstance(transcripts, list):
+        return
+    for item in transcripts:
+        if not isinstance(item, dict):
+            continue
+        segments = [segment for segment in map(_sentence_segment, item.get("sentences") or []) if segment]
+        if segments:
+            yield from segments
+            continue
+        value = item.get("text")
+        if isinstance(value, str) and value.strip():
+            yield 0, 0, value.strip()
+
+
+def _sentence_segment(sentence: Any) -> tuple[int, int, str] | None:
+    if not isinstance(sentence, dict):
+        return None
+    text = sentence.get("text")
+    if not isinstance(text, str) or not text.strip():
+        return None
+    start = int(sentence.get("begin_time") or 0)
+    end = int(sentence.get("end_time") or start)
+    return start, max(end, start), text.strip()
 
 
 def _extract_asr_from_output(output: Any) -> str:
@@ -0,0 +1,110 @@
+import json
+import re
+
+PREFERRED_LANGS = ("zh-Hans", "zh-CN", "zh", "zh-Hant", "zh-TW", "zh-HK", "ai-zh")
+PREFERRED_EXTS = ("srt", "vtt", "json3", "json")
+IGNORED_TRACKS = {"danmaku", "live_chat"}
+
+_TIME_RE = re.compile(r"(?:(\d+):)?(\d{1,2}):(\d{2})[.,](\d{1,3})")
+_TAG_RE = re.compile(r"<[^>]+>|\{\\[^}]*\}")
+
+
+def pick_track(info: dict) -> tuple[str, dict] | None:
+    """Choose the best subtitle track from yt-dlp metadata.
+
+    Uploaded subtitles win over automatic captions; Chinese tracks win over other languages.
+    Automatic captions are only used in Chinese or the video's own language, since yt-dlp
+    lists machine translations there too.
+    """
+    manual = {lang: formats for lang, formats in (info.get("subtitles") or {}).items() if lang not in IGNORED_TRACKS}
+    automatic = info.get("automatic_captions") or {}
+    original = info.get("language")
+    for tracks, allow_any in ((manual, True), (automatic, False)):
+        langs = [lang for lang in PREFERRED_LANGS if tracks.get(lang)]
+        if original and tracks.get(original):
+            langs.append(original)
+        if allow_any:
+            langs.extend(sorted(lang for lang in tracks if tracks[lang] and lang not in langs))
+        for lang in langs:
+            entry = _pick_format(tracks[lang])
+            if entry:
+                return lang, entry
+    return None
+
+
+def parse_subtitle(data: str, ext: str) -> list[tuple[float, float, str]]:
+    """Convert a subtitle document to ``(start_seconds, end_seconds, text)`` cues."""
+    ext = (ext or "").lower()
+    stripped = data.lstrip("\ufeff").lstrip()
+    if ext in {"json", "json3"} or stripped.startswith("{"):
+        cues = _parse_json(json.loads(stripped))
+    else:
+        cues = _parse_timed_text(stripped)
+    merged: list[tuple[float, float, str]] = []
+    for start, end, text in cues:
+        if not text:
+            continue
+        if merged and merged[-1][2] == text:
+            merged[-1] = (merged[-1][0], end, text)
+            continue
+        merged.append((start, end, text))
+    return merged
+
+
+def cues_to_text(cues: list[tuple[float, float, str]]) -> str:
+    return "\n".join(text for _, _, text in cues)
+
+
+def _pick_format(formats: list[dict]) -> dict | None:
+    usable = [item for item in formats if isinstance(item, dict) and (item.get("data") or item.get("url"))]
+    for ext in PREFERRED_EXTS:
+        for item in usable:
+            if item.get("ext") == ext:
+                return item
+    return None
+
+
+def _parse_json(data: dict) -> list[tuple[float, float, str]]:
+    if isinstance(data.get("body"), list):  # bilibili CC / AI subtitles
+        return [
+            (float(item.get("from") or 0), float(item.get("to") or 0), _clean(str(item.get("content") or "")))
+            for item in data["body"]
+            if isinstance(item, dict)
+        ]
+    cues = []
+    for event in data.get("events") or []:  # YouTube json3
+        segs = event.get("segs") if isinstance(event, dict) else None
+        if not segs:
+            continue
+        start = float(event.get("tStartMs") or 0) / 1000
+        end = start + float(event.get("dDurationMs") or 0) / 1000
+        cues.append((start, end, _clean("".join(str(seg.get("utf8") or "") for seg in segs))))
+    return cues
+
+
+def _parse_timed_text(data: str) -> list[tuple[float, float, str]]:
+    cues = []
+    for block in re.split(r"\r?\n\s*\r?\n", data):
+        lines = [line.strip() for line in block.splitlines() if line.strip()]
+        for index, line in enumerate(lines):
+            if "-->" not in line:
+                continue
+            start_text, _, end_text = line.partition("-->")
+            start, end = _parse_time(start_text), _parse_time(end_text)
+            if start is None or end is None:
+                break
+            cues.append((start, end, _clean(" ".join(lines[index + 1 :]))))
+            break
+    return cues
+
+
+def _parse_time(value: str) -> float | None:
+    match = _TIME_RE.search(value)
+    if not match:
+        return None
+    hours, minutes, seconds, fraction = match.groups()
+    return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds) + int(fraction.ljust(3, "0")) / 1000
+
+
+def _clean(text: str) -> str:
+    return re.sub(r"\s+", " ", _TAG_RE.sub("", text)).strip()
@@ -0,0 +1,122 @@
+import re
+from urllib.parse import parse_qs, urlparse
+
+# Bilibili av <-> BV conversion (current 51-bit scheme).
+_BV_XOR = 23442827791579
+_BV_MASK = 2251799813685247
+_BV_MAX_AID = 1 << 51
+_BV_ALPHABET = "FcwAPNKTMug3GV5Lj7EJnHpWsx4tb8haYeviqBz6rkCy12mUSDQX9RdoZf"
+_BV_ENCODE_MAP = (8, 7, 0, 5, 1, 3, 2, 4, 6)
+_BV_DECODE_MAP = tuple(reversed(_BV_ENCODE_MAP))
+
+_BV_RE = re.compile(r"(?i:bv)(1[0-9A-Za-z]{9})")
+_AV_RE = re.compile(r"(?i:av)(\d+)")
+_YOUTUBE_ID_RE = re.compile(r"^[0-9A-Za-z_-]{11}$")
+_YTDLP_BILIBILI_ID_RE = re.compile(r"^(BV1[0-9A-Za-z]{9})(?:_p(\d+))?$")
+
+BILIBILI_HOSTS = ("bilibili.com", "b23.tv")
+YOUTUBE_HOSTS = ("youtube.com", "youtu.be", "youtube-nocookie.com")
+
+
+def av_to_bv(aid: int) -> str:
+    chars = [""] * len(_BV_ENCODE_MAP)
+    tmp = (_BV_MAX_AID | aid) ^ _BV_XOR
+    for index in _BV_ENCODE_MAP:
+        chars[index] = _BV_ALPHABET[tmp % len(_BV_ALPHABET)]
+        tmp //= len(_BV_ALPHABET)
+    return "BV1" + "".join(chars)
+
+
+def bv_to_av(bvid: str) -> int:
+    code = bvid[3:]
+    tmp = 0
+    for index in _BV_DECODE_MAP:
+        tmp = tmp * len(_BV_ALPHABET) + _BV_ALPHABET.index(code[index])
+    return (tmp ^ _BV_XOR) & _BV_MASK
+
+
+def bilibili_key(bvid: str, part: int | None = None) -> str:
+    key = f"bilibili:BV{bvid[2:]}"
+    if part and part > 1:
+        key += f":p{part}"
+    return key
+
+
+def canonical_video_key(url: str) -> str | None:
+    """Normalize common Bilibili/YouTube URL forms to a platform video key without network access.
+
+    Returns None when the URL needs resolving (e.g. b23.tv short codes) or the platform is unknown.
+    """
+    raw = (url or "").strip()
+    if not raw:
+        return None
+    if "/" not in raw and "." not in raw:
+        return _bilibili_from_segment(raw, None)
+    parsed = urlparse(raw if "://" in raw else f"https://{raw}")
+    host = (parsed.hostname or "").lower()
+    query = parse_qs(parsed.query)
+    if _host_matches(host, BILIBILI_HOSTS):
+        part = _int_param(query, "p")
+        bvid = (query.get("bvid") or [None])[0]
+        if bvid and _BV_RE.fullmatch(bvid):
+            return bilibili_key(bvid, part)
+        for segment in parsed.path.split("/"):
+            key = _bilibili_from_segment(segment, part)
+            if key:
+                return key
+        return None
+    if _host_matches(host, YOUTUBE_HOSTS):
+        video_id = None
+        segments = [segment for segment in parsed.path.split("/") if segment]
+        if host.endswith("youtu.be") and segments:
+            video_id = segments[0]
+        elif segments and segments[0] == "watch":
+            video_id = (query.get("v") or [None])[0]
+        elif len(segments) >= 2 and segments[0] in {"shorts", "embed", "live", "v"}:
+            video_id = segments[1]
+        if video_id and _YOUTUBE_ID_RE.match(video_id):
+            return f"youtube:{video_id}"
+    return None
+
+
+def key_from_info(info: dict) -> str | None:
+    """Build a video key from yt-dlp metadata (extract_info with download=False)."""
+    video_id = str(info.get("id") or "")
+    extractor = str(info.get("extractor_key") or info.get("extractor") or "").lower()
+    if not video_id or not extractor:
+        return None
+    if extractor.startswith("bilibili"):
+        match = _YTDLP_BILIBILI_ID_RE.match(video_id)
+        if match:
+            return bilibili_key(match.group(1), int(match.group(2)) if match.group(2) else None)
+    if extractor == "youtube":
+        return f"youtube:{video_id}"
+    return f"{extractor}:{video_id}"
+
+
+def fallback_key(url: str) -> str:
+    return f"url:{(url or '').strip()}"
+
+
+def _bilibili_from_segment(segment: str, part: int | None) -> str | None:
+    match = _BV_RE.fullmatch(segment)
+    if match:
+        return bilibili_key(f"BV{match.group(1)}", part)
+    match = _AV_RE.fullmatch(segment)
+    if match:
+        aid = int(match.group(1))
+        if 0 < aid < _BV_MAX_AID:
+            return bilibili_key(av_to_bv(aid), part)
+    return None
+
+
+def _host_matches(host: str, domains: tuple[str, ...]) -> bool:
+    return any(host == domain or host.endswith(f".{domain}") for domain in domains)
+
+
+def _int_param(query: dict[str, list[str]], name: str) -> int | None:
+    value = (query.get(name) or [None])[0]
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
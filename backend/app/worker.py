@@ -0,0 +1,167 @@
+import argparse
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Callable
+
+from . import db
+from .pipeline import process_note, process_session
+from .qwen_client import sweep_uploads
+
+LEASE_SECONDS = float(os.getenv("QKNOTE_LEASE_SECONDS", "60"))
+POLL_SECONDS = float(os.getenv("QKNOTE_POLL_SECONDS", "2"))
+MAX_ATTEMPTS = int(os.getenv("QKNOTE_MAX_ATTEMPTS", "3"))
+EMBEDDED_WORKERS = int(os.getenv("QKNOTE_EMBEDDED_WORKERS", "2"))
+# Upload sweeps take the SQLite write lock, so one thread per process runs them at this interval.
+SWEEP_SECONDS = float(os.getenv("QKNOTE_UPLOAD_SWEEP_SECONDS", "60"))
+
+_wake = threading.Event()
+_sweep_lock = threading.Lock()
+_next_sweep = 0.0
+
+
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+def notify() -> None:
+    """Wake idle workers in this process so new sessions start without waiting a poll interval."""
+    _wake.set()
+
+
+class _Heartbeat:
+    def __init__(self, label: str, renew: Callable[[], bool]) -> None:
+        self.label = label
+        self.renew = renew
+        self._stop = threading.Event()
+        # Set once renewal fails: the job may already be claimed by another worker.
+        self.lost = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{label}", daemon=True)
+
+    def __enter__(self) -> "_Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        interval = max(LEASE_SECONDS / 3, 1.0)
+        while not self._stop.wait(interval):
+            try:
+                if not self.renew():
+                    print(f"[worker] lost lease on {self.label}")
+                    self.lost.set()
+                    return
+            except Exception as exc:
+                print(f"[worker] heartbeat failed for {self.label}: {exc}")
+
+
+def _sweep_uploads_due() -> None:
+    global _next_sweep
+    with _sweep_lock:
+        now = time.monotonic()
+        if now < _next_sweep:
+            return
+        _next_sweep = now + SWEEP_SECONDS
+    try:
+        sweep_uploads()
+    except Exception as exc:
+        print(f"[worker] upload sweep failed: {exc}")
+
+
+def run_once(worker_id: str) -> bool:
+    session = db.claim_next_session(worker_id, LEASE_SECONDS, MAX_ATTEMPTS)
+    if not session:
+        return False
+    session_id = int(session["id"])
+    print(f"[worker] {worker_id} claimed session {session_id} (attempt {session['attempts']})")
+    renew = lambda: db.renew_session_lease(session_id, worker_id, LEASE_SECONDS)
+    heartbeat = _Heartbeat(f"session {session_id}", renew)
+    try:
+        with heartbeat:
+            process_session(session_id, bool(session["include_joke"]), heartbeat.lost)
+    except Exception as exc:
+        print(f"[worker] session {session_id} crashed: {exc}")
+        if not heartbeat.lost.is_set():
+            db.update_session(session_id, status="failed", error=f"worker error: {exc}")
+    finally:
+        db.release_session_lease(session_id, worker_id)
+    return True
+
+
+def run_note_once(worker_id: str) -> bool:
+    note = db.claim_next_note(worker_id, LEASE_SECONDS, MAX_ATTEMPTS)
+    if not note:
+        return False
+    note_id = int(note["id"])
+    print(f"[worker] {worker_id} claimed note {note_id} for session {note['session_id']}")
+    renew = lambda: db.renew_note_lease(note_id, worker_id, LEASE_SECONDS)
+    heartbeat = _Heartbeat(f"note {note_id}", renew)
+    try:
+        with heartbeat:
+            process_note(note, heartbeat.lost)
+    except Exception as exc:
+        print(f"[worker] note {note_id} crashed: {exc}")
+        if not heartbeat.lost.is_set():
+            db.update_note(note_id, status="failed", error=f"worker error: {exc}")
+    finally:
+        db.release_note_lease(note_id, worker_id)
+    return True
+
+
+def run_worker(worker_id: str, stop_event: threading.Event) -> None:
+    while not stop_event.is_set():
+        # Uploads are kept for reuse across attempts; expired ones are deleted between sessions.
+        _sweep_uploads_due()
+        try:
+            # Re-style jobs are a single LLM call, so they go ahead of full pipeline runs.
+            if run_note_once(worker_id) or run_once(worker_id):
+                continue
+        except Exception as exc:
+            print(f"[worker] {worker_id} claim failed: {exc}")
+        _wake.wait(POLL_SECONDS)
+        _wake.clear()
+
+
+def start_workers(count: int, stop_event: threading.Event) -> list[threading.Thread]:
+    base_id = new_worker_id()
+    threads = []
+    for index in range(count):
+        thread = threading.Thread(
+            target=run_worker,
+            args=(f"{base_id}-{index}", stop_event),
+            name=f"qknote-worker-{index}",
+            daemon=True,
+        )
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Process queued QkNote sessions.")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("QKNOTE_WORKER_CONCURRENCY", "2")))
+    args = parser.parse_args(argv)
+
+    db.init_db()
+    stop_event = threading.Event()
+    threads = start_workers(max(args.concurrency, 1), stop_event)
+    print(f"[worker] started {len(threads)} threads, data dir {db.DATA_DIR}")
+    try:
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=1)
+    except KeyboardInterrupt:
+        print("[worker] stopping after current sessions")
+        stop_event.set()
+        _wake.set()
+        for thread in threads:
+            thread.join()
+
+
+if __name__ == "__main__":
+    main()
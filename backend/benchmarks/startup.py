@@ -0,0 +1,116 @@
+"""Startup budget check for the backend.
+
+Run from the backend directory:
+
+    python benchmarks/startup.py
+
+Measures, in fresh interpreters, how long `import app.main` takes and how long
+uvicorn needs from process spawn until `GET /api/config` answers. Exits with a
+non-zero status when either number exceeds its budget or when a heavy
+dependency (yt_dlp, dashscope) is imported eagerly.
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+IMPORT_BUDGET_MS = float(os.getenv("QKNOTE_IMPORT_BUDGET_MS", "1500"))
+FIRST_RESPONSE_BUDGET_MS = float(os.getenv("QKNOTE_FIRST_RESPONSE_BUDGET_MS", "4000"))
+RUNS = int(os.getenv("QKNOTE_STARTUP_RUNS", "3"))
+LAZY_MODULES = ("yt_dlp", "dashscope")
+
+IMPORT_PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import app.main
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({{"ms": elapsed, "eager": [name for name in {LAZY_MODULES!r} if name in sys.modules]}}))
+"""
+
+
+def _env(data_dir: str) -> dict[str, str]:
+    env = dict(os.environ)
+    env["QKNOTE_DATA_DIR"] = data_dir
+    env["QKNOTE_EMBEDDED_WORKERS"] = "0"
+    return env
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import(data_dir: str) -> tuple[float, list[str]]:
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE],
+        cwd=BACKEND_DIR,
+        env=_env(data_dir),
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    data = json.loads(result.stdout.strip().splitlines()[-1])
+    return data["ms"], data["eager"]
+
+
+def measure_first_response(data_dir: str, timeout: float = 30.0) -> float:
+    port = _free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=_env(data_dir),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}/api/config"
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - start) * 1000
+            except (urllib.error.URLError, ConnectionError, OSError):
+                time.sleep(0.02)
+        raise RuntimeError(f"no response from {url} within {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main() -> int:
+    failures = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        # First run creates the schema; later runs take the schema-version fast path.
+        import_times, eager = [], set()
+        for _ in range(RUNS + 1):
+            elapsed, eager_modules = measure_import(data_dir)
+            import_times.append(elapsed)
+            eager.update(eager_modules)
+        response_times = [measure_first_response(data_dir) for _ in range(RUNS + 1)]
+
+    import_ms = min(import_times[1:])
+    response_ms = min(response_times[1:])
+    print(f"import app.main: {import_ms:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms)")
+    print(f"time to first /api/config: {response_ms:.0f} ms (budget {FIRST_RESPONSE_BUDGET_MS:.0f} ms)")
+    if eager:
+        failures.append(f"heavy modules imported at startup: {', '.join(sorted(eager))}")
+    if import_ms > IMPORT_BUDGET_MS:
+        failures.append("import budget exceeded")
+    if response_ms > FIRST_RESPONSE_BUDGET_MS:
+        failures.append("first response budget exceeded")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
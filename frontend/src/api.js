@@ -22,6 +22,12 @@ export function saveConfig(payload) {
   });
 }
 
+export function deleteApiKey(keyId) {
+  return fetchJson(`/api/config/keys/${keyId}`, {
+    method: "DELETE",
+  });
+}
+
 export function createSession(payload) {
   return fetchJson("/api/sessions", {
     method: "POST",
@@ -42,3 +48,18 @@ export function deleteSession(sessionId) {
     method: "DELETE",
   });
 }
+
+export function createNotes(sessionId, payload) {
+  return fetchJson(`/api/sessions/${sessionId}/notes`, {
+    method: "POST",
+    body: JSON.stringify(payload),
+  });
+}
+
+export function findSegment(sessionId, seconds) {
+  return fetchJson(`/api/sessions/${sessionId}/segments/at?t=${seconds}`);
+}
+
+export function listSegments(sessionId, start, end) {
+  return fetchJson(`/api/sessions/${sessionId}/segments?start=${start}&end=${end}`);
+}